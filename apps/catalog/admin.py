@@ -1,20 +1,30 @@
 # apps/catalog/admin.py
 from django.contrib import admin
+from django.utils import timezone
+
 from .models import Category, Product
+from .signals import invalidate_bulk
 
 
 # --- общие экшены -------------------------------------------------------------
 @admin.action(description="Мягко удалить (is_active=False)")
 def soft_delete(modeladmin, request, queryset):
-    for obj in queryset:
-        # используем метод модели (он обновляет updated_at)
-        if hasattr(obj, "soft_delete"):
-            obj.soft_delete()
+    # один UPDATE вместо save() на каждый объект; updated_at проставляем вручную (auto_now не сработает)
+    active = queryset.filter(is_active=True)
+    pks = list(active.values_list("pk", flat=True))
+    if pks:
+        active.update(is_active=False, updated_at=timezone.now())
+        # .update() не шлёт post_save — инвалидируем кэш сами
+        invalidate_bulk(queryset.model, pks)
 
 
 @admin.action(description="Восстановить (is_active=True)")
 def restore(modeladmin, request, queryset):
-    queryset.update(is_active=True)
+    inactive = queryset.filter(is_active=False)
+    pks = list(inactive.values_list("pk", flat=True))
+    if pks:
+        inactive.update(is_active=True, updated_at=timezone.now())
+        invalidate_bulk(queryset.model, pks)
 
 
 # --- Category -----------------------------------------------------------------
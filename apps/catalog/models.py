@@ -1,8 +1,24 @@
+import re
+
 from django.core.exceptions import ValidationError
 from django.db import models
 from django.db.models.functions import Lower
 from django.utils.text import slugify
 
+_SLUG_STRIP = re.compile(r'[^\w\s-]')
+_SLUG_HYPHENATE = re.compile(r'[-\s]+')
+
+
+def fast_slugify(value: str) -> str:
+    """
+    slugify без unicodedata.normalize для ASCII-строк (результат тот же, что у django slugify).
+    Не-ASCII — штатный slugify.
+    """
+    value = str(value)
+    if not value.isascii():
+        return slugify(value)
+    return _SLUG_HYPHENATE.sub('-', _SLUG_STRIP.sub('', value.lower())).strip('-_')
+
 
 class Category(models.Model):
     """Модель для категорий товаров"""
@@ -18,12 +34,26 @@ class Category(models.Model):
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Создано')
     updated_at = models.DateTimeField(auto_now=True, help_text='Обновлено')
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # имя на момент загрузки — сигнал синхронизирует Product.category_name только при реальном переименовании
+        instance._loaded_name = instance.__dict__.get('name')
+        return instance
+
     def save(self, *args, **kwargs):
         """
         Нормализация name/slug.
         - если slug пуст, генерируем из name; иначе нормализуем перед сохранением.
         - trim для name; защита от пустого slug после slugify.
+        - если update_fields не затрагивает name/slug (soft_delete и т.п.) — нормализацию пропускаем.
         """
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and not {'name', 'slug'} & set(update_fields):
+            super().save(*args, **kwargs)
+            self._loaded_name = self.name
+            return
+
         if self.name:
             self.name = self.name.strip()
 
@@ -31,11 +61,12 @@ class Category(models.Model):
         if not base_slug and self.name:
             base_slug = self.name
 
-        self.slug = slugify(base_slug)[:100]
+        self.slug = fast_slugify(base_slug)[:100]
         if not self.slug:
             raise ValidationError('Slug не может быть пустым после нормализации')
 
         super().save(*args, **kwargs)
+        self._loaded_name = self.name
 
     def soft_delete(self):
         """Мягкое удаление (is_active = False)."""
@@ -67,18 +98,43 @@ class Product(models.Model):
     category = models.ForeignKey(
         Category,
         on_delete=models.PROTECT,
-        db_index=True,
+        db_index=False,  # покрывается составным (category, is_active, -created_at)
         related_name='products',
         verbose_name='Категория',
     )
-    is_active = models.BooleanField(default=True, db_index=True, verbose_name='Активно')
-    created_at = models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Создано')
+    # денормализованное имя категории: список продуктов отдаём без JOIN на catalog_category
+    category_name = models.CharField(
+        max_length=100, blank=True, default='', editable=False, verbose_name='Имя категории',
+    )
+    # отдельные индексы не нужны: выборки идут через составной и частичный product_active_list_cov
+    is_active = models.BooleanField(default=True, verbose_name='Активно')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Создано')
     updated_at = models.DateTimeField(auto_now=True, verbose_name='Обновлено')
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # категория на момент загрузки — save() не читает имя категории, если она не менялась
+        instance._loaded_category_id = instance.__dict__.get('category_id')
+        return instance
+
     def save(self, *args, **kwargs):
-        if self.name:
+        update_fields = kwargs.get('update_fields')
+        if self.name and (update_fields is None or 'name' in update_fields):
             self.name = self.name.strip()
+        # category_name берём из категории только при её смене или если поле пустое:
+        # иначе self.category — лишний SELECT на каждое сохранение (переименования синхронизирует сигнал)
+        category_changed = self.category_id != getattr(self, '_loaded_category_id', None)
+        if (
+            self.category_id
+            and (update_fields is None or 'category' in update_fields)
+            and (category_changed or not self.category_name)
+        ):
+            self.category_name = self.category.name
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'category_name'}
         super().save(*args, **kwargs)
+        self._loaded_category_id = self.category_id
 
     def soft_delete(self):
         """Мягкое удаление продукта (is_active = False)."""
@@ -92,6 +148,14 @@ class Product(models.Model):
             models.Index(fields=['price']),
             models.Index(fields=['category', 'is_active', '-created_at']),
             models.Index(Lower('name'), name='product_name_lower_idx'),
+            # покрывающий частичный индекс под ProductListView: is_active=True, ORDER BY lower(name),
+            # фильтры по price/category; INCLUDE — колонки ответа, чтобы PostgreSQL сделал index-only scan
+            models.Index(
+                Lower('name'), models.F('price'), models.F('category_id'),
+                condition=models.Q(is_active=True),
+                include=['id', 'name', 'category_name'],
+                name='product_active_list_cov',
+            ),
         ]
         constraints = [
             models.CheckConstraint(condition=models.Q(price__gte=0), name="price_gte_0"),
@@ -1,19 +1,37 @@
-from django.utils.text import slugify
+import copy
+
 from rest_framework import serializers
 
-from apps.catalog.models import Category, Product
+from apps.catalog.models import Category, Product, fast_slugify
+
+
+class CachedFieldsSerializerMixin:
+    """
+    Кэш полей ModelSerializer на уровне класса.
+    DRF на каждый инстанс делает deepcopy(_declared_fields) и заново строит поля по модели;
+    здесь поля строятся один раз, а инстансу отдаются их поверхностные копии
+    (bind() пишет в копию, общий шаблон не мутирует).
+    """
 
+    def get_fields(self):
+        cls = type(self)
+        cached = cls.__dict__.get("_cached_fields")  # только свой класс, не родительский
+        if cached is None:
+            cached = super().get_fields()
+            cls._cached_fields = cached
+        return {name: copy.copy(field) for name, field in cached.items()}
 
-class CategoryListSerializer(serializers.ModelSerializer):
-    """Сериализатор списка категорий для публичного API (id, name, slug, created_at, updated_at)."""
+
+class CategoryListSerializer(CachedFieldsSerializerMixin, serializers.ModelSerializer):
+    """Сериализатор списка категорий для публичного API (id, name, slug)."""
 
     class Meta:
         model = Category
-        fields = ['id', 'name', 'slug', 'created_at', 'updated_at']
-        read_only_fields = ['id', 'created_at', 'updated_at']
+        fields = ['id', 'name', 'slug']
+        read_only_fields = ['id']
 
 
-class CategoryDetailSerializer(serializers.ModelSerializer):
+class CategoryDetailSerializer(CachedFieldsSerializerMixin, serializers.ModelSerializer):
     """Сериализатор деталей категории для публичного API (id, name, slug, created_at, updated_at)."""
 
     class Meta:
@@ -37,18 +55,18 @@ def validate_slug(self, value):
     - проверяем непустоту после нормализации
     """
     if value:
-        new_slug = slugify(value)
+        new_slug = fast_slugify(value)
     else:
         name = (self.initial_data.get('name') if isinstance(self.initial_data, dict) else None) \
                or getattr(self.instance, 'name', '')
-        new_slug = slugify(name or '')
+        new_slug = fast_slugify(name or '')
     new_slug = (new_slug or '')[:100]
     if not new_slug:
         raise serializers.ValidationError('Slug не может быть пустым')
     return new_slug
 
 
-class CategoryInlineSerializer(serializers.ModelSerializer):
+class CategoryInlineSerializer(CachedFieldsSerializerMixin, serializers.ModelSerializer):
     """Короткое представление категории внутри продукта (public)."""
 
     class Meta:
@@ -57,9 +75,9 @@ class CategoryInlineSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'name', 'slug']
 
 
-class ProductListSerializer(serializers.ModelSerializer):
+class ProductListSerializer(CachedFieldsSerializerMixin, serializers.ModelSerializer):
     """Сериализатор списка продуктов для публичного API (id, name, price, имя категории)."""
-    category = serializers.CharField(source='category.name', read_only=True)
+    category = serializers.CharField(source='category_name', read_only=True)
 
     class Meta:
         model = Product
@@ -67,7 +85,7 @@ class ProductListSerializer(serializers.ModelSerializer):
         read_only_fields = ['id']
 
 
-class ProductDetailSerializer(serializers.ModelSerializer):
+class ProductDetailSerializer(CachedFieldsSerializerMixin, serializers.ModelSerializer):
     """
     Детали продукта для публичного API.
     Публичный контракт: без is_active (неактивные продукты не выдаём, см. вью).
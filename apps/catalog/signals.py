@@ -1,52 +1,117 @@
 from django.core.cache import cache
-from django.db.models.signals import post_save, post_delete
+from django.db import connections
+from django.db.models import OuterRef, Subquery
+from django.db.models.signals import post_migrate, post_save, post_delete
 from django.dispatch import receiver
 
 from apps.catalog.models import Product, Category
+from online_store.cache_utils import incr_version
 
 
 # ---- утилиты для версий списков ----
 
-def _incr_version(key: str, initial: int = 1) -> None:
+# префикс ключа детали и ключ версии списков для каждой модели
+_CACHE_KEYS = {
+    Category: ("category", "categories:list:version"),
+    Product: ("product", "products:list:version"),
+}
+
+
+def invalidate_bulk(model, pks) -> None:
     """
-    Атомарно инкрементируем версию списка в Memcached.
-    Если ключа нет — создаём с initial, затем инкрементируем.
+    Инвалидация кэша для bulk-путей (QuerySet.update() не шлёт post_save):
+    сбрасываем детали одним delete_many и один раз поднимаем версию списков.
     """
-    cache.add(key, initial)  # если ключа нет — создаём
-    try:
-        cache.incr(key)
-    except Exception:
-        current = cache.get(key) or initial
-        cache.set(key, int(current) + 1)
+    prefix, version_key = _CACHE_KEYS[model]
+    cache.delete_many([f"{prefix}:{pk}" for pk in pks])
+    incr_version(version_key)
 
 
 # ---- Category: инвалидация ----
 
 @receiver(post_save, sender=Category, dispatch_uid="category_saved_cache_invalidation")
 def category_saved(sender, instance: Category, **kwargs):
-    # Сбрасываем деталь
-    cache.delete(f"category:{instance.pk}")
+    # Сбрасываем деталь (у только что созданной её в кэше быть не может — лишний round-trip не делаем)
+    if not kwargs.get("created"):
+        cache.delete(f"category:{instance.pk}")
     # Инкремент версии списков категорий (используется в ключе CategoryListView)
-    _incr_version("categories:list:version")
+    incr_version("categories:list:version")
+
+    # Синхронизируем денормализованное Product.category_name (update() не шлёт post_save продуктов) —
+    # только если имя действительно сменилось: _loaded_name (см. Category.from_db/save) обновляется
+    # после post_save, поэтому здесь это ещё прежнее имя; None — инстанс собран не из БД, проверяем по факту
+    update_fields = kwargs.get("update_fields")
+    old_name = getattr(instance, "_loaded_name", None)
+    if (
+        not kwargs.get("created")
+        and (update_fields is None or "name" in update_fields)
+        and old_name != instance.name
+    ):
+        renamed = (
+            Product.objects.filter(category=instance)
+            .exclude(category_name=instance.name)
+            .update(category_name=instance.name)
+        )
+        if renamed:
+            incr_version("products:list:version")
 
 
 @receiver(post_delete, sender=Category, dispatch_uid="category_deleted_cache_invalidation")
 def category_deleted(sender, instance: Category, **kwargs):
     cache.delete(f"category:{instance.pk}")
-    _incr_version("categories:list:version")
+    incr_version("categories:list:version")
 
 
 # ---- Product: инвалидация ----
 
 @receiver(post_save, sender=Product, dispatch_uid="product_saved_cache_invalidation")
 def product_saved(sender, instance: Product, **kwargs):
-    # Деталь продукта (используется в ProductDetailView)
-    cache.delete(f"product:{instance.pk}")
+    # Деталь продукта (используется в ProductDetailView); при создании сбрасывать нечего
+    if not kwargs.get("created"):
+        cache.delete(f"product:{instance.pk}")
     # Инкремент версии списков продуктов (используется в ключе ProductListView)
-    _incr_version("products:list:version")
+    incr_version("products:list:version")
 
 
 @receiver(post_delete, sender=Product, dispatch_uid="product_deleted_cache_invalidation")
 def product_deleted(sender, instance: Product, **kwargs):
     cache.delete(f"product:{instance.pk}")
-    _incr_version("products:list:version")
+    incr_version("products:list:version")
+
+
+# ---- бэкфилл денормализованных полей ----
+
+@receiver(post_migrate, dispatch_uid="product_category_name_backfill")
+def backfill_product_category_name(sender, using=None, **kwargs):
+    """Заполняем Product.category_name у строк, созданных до появления колонки (миграции — при старте)."""
+    if sender.name != "apps.catalog":
+        return
+    category_name = Category.objects.filter(pk=OuterRef("category_id")).values("name")[:1]
+    Product.objects.using(using).filter(category_name="").update(category_name=Subquery(category_name))
+
+
+# ---- индексы под поиск ----
+
+# поиск в списках строит LOWER(name) LIKE '%term%' — btree по такому не работает,
+# GIN с gin_trgm_ops по тому же выражению — работает
+_TRIGRAM_INDEXES = (
+    ("product_name_lower_trgm", Product),
+    ("category_name_lower_trgm", Category),
+)
+
+
+@receiver(post_migrate, dispatch_uid="catalog_trigram_indexes")
+def create_trigram_indexes(sender, using="default", **kwargs):
+    """Идемпотентно создаём pg_trgm-индексы для ?search= (только PostgreSQL)."""
+    if sender.name != "apps.catalog":
+        return
+    connection = connections[using]
+    if connection.vendor != "postgresql":
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        for name, model in _TRIGRAM_INDEXES:
+            cursor.execute(
+                f'CREATE INDEX IF NOT EXISTS {name} ON "{model._meta.db_table}" '
+                f'USING gin ((LOWER("name")) gin_trgm_ops)'
+            )
@@ -2,14 +2,20 @@ import pytest
 from django.core.cache import cache
 from rest_framework.test import APIClient
 
+from apps.catalog import views as catalog_views
 from apps.catalog.models import Category, Product
+from online_store import cache_utils
 
 
 @pytest.fixture(autouse=True)
 def clear_cache():
     cache.clear()
+    catalog_views._CATEGORY_L1.clear()
+    cache_utils._LOCAL_VERSIONS.clear()
     yield
     cache.clear()
+    catalog_views._CATEGORY_L1.clear()
+    cache_utils._LOCAL_VERSIONS.clear()
 
 
 @pytest.fixture
@@ -1,5 +1,6 @@
 import pytest
 from django.urls import reverse
+from apps.catalog import views as catalog_views
 from apps.catalog.models import Category, Product
 
 
@@ -68,3 +69,29 @@ def test_category_delete_soft_and_hard_constraints(admin_client, category):
     r_hard_ok = admin_client.delete(url2 + "?hard=true")
     assert r_hard_ok.status_code == 204
     assert Category.objects.filter(pk=cat2.id).exists() is False
+
+
+@pytest.mark.django_db
+def test_category_detail_l1_hit_skips_memcached(api_client, category, monkeypatch, no_cache_reads):
+    url = reverse("categories-detail", kwargs={"pk": category.id})
+    assert api_client.get(url)["X-Cache"] == "MISS"
+
+    # версия списков свежая в процессе, деталь — в L1: повторный GET не читает Memcached вовсе
+    monkeypatch.setattr(catalog_views, "cache", no_cache_reads)
+    r = api_client.get(url)
+    assert r.status_code == 200
+    assert r["X-Cache"] == "HIT"
+    assert r.json()["name"] == "Electronics"
+
+
+@pytest.mark.django_db
+def test_category_detail_l1_invalidated_on_rename(api_client, category):
+    url = reverse("categories-detail", kwargs={"pk": category.id})
+    api_client.get(url)
+
+    # bump версии в этом процессе сразу попадает в процессный кэш версий — старая запись L1 не находится
+    category.name = "Gadgets"
+    category.save()
+    r = api_client.get(url)
+    assert r["X-Cache"] == "MISS"
+    assert r.json()["name"] == "Gadgets"
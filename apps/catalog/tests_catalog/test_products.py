@@ -1,6 +1,9 @@
 import pytest
+from django.core.cache import cache
 from django.urls import reverse
-from apps.catalog.models import Product
+from apps.catalog import views as catalog_views
+from apps.catalog.models import Category, Product
+from online_store import cache_utils
 
 
 @pytest.mark.django_db
@@ -33,7 +36,7 @@ def test_product_list_filters_and_cache_version_bump(api_client, product):
     assert api_client.get(url, {"price_max": "1000"}).status_code == 200
 
     # --- проверяем версионирование списка (сигналы инкрементируют версию) ---
-    # Изменяем продукт (post_save триггерит _incr_version("products:list:version"))
+    # Изменяем продукт (post_save триггерит incr_version("products:list:version"))
     product.price = 888
     product.save()
 
@@ -58,3 +61,122 @@ def test_product_detail_active_vs_inactive(api_client, product, inactive_product
     url_inactive = reverse("products-detail", kwargs={"pk": inactive_product.id})
     r_inactive = api_client.get(url_inactive)
     assert r_inactive.status_code == 404
+
+
+@pytest.mark.django_db
+def test_product_detail_ignores_legacy_dict_cache_entry(api_client, product):
+    # до перехода на готовые JSON-байты в кэше лежал dict — такой записи отдавать нельзя
+    cache.set(f"product:{product.id}", {"id": product.id, "name": "stale"})
+
+    r = api_client.get(reverse("products-detail", kwargs={"pk": product.id}))
+    assert r.status_code == 200
+    assert r["X-Cache"] == "MISS"
+    assert r.json()["name"] == product.name
+
+
+@pytest.mark.django_db
+def test_product_category_name_follows_category_rename(api_client, product):
+    # денормализованное имя категории проставляется при сохранении продукта
+    assert product.category_name == "Electronics"
+
+    # переименование категории синхронизирует category_name у её продуктов
+    category = product.category
+    category.name = "Gadgets"
+    category.save()
+    product.refresh_from_db()
+    assert product.category_name == "Gadgets"
+
+    r = api_client.get(reverse("products-list"))
+    assert r.status_code == 200
+    assert r.json()[0]["category"] == "Gadgets"
+
+
+@pytest.mark.django_db
+def test_saves_without_category_change_skip_extra_queries(product, django_assert_num_queries):
+    # продукт без смены категории: только UPDATE, без SELECT категории ради category_name
+    p = Product.objects.get(pk=product.pk)
+    p.stock = 5
+    with django_assert_num_queries(1):
+        p.save()
+
+    # категория без переименования: только UPDATE, без синхронизации category_name у продуктов
+    c = Category.objects.get(pk=product.category_id)
+    c.is_active = True
+    with django_assert_num_queries(1):
+        c.save()
+
+
+class _RecordingCache:
+    """Обёртка над кэшем, запоминающая чтения: ("get", key) / ("get_many", keys)."""
+
+    def __init__(self):
+        self.reads = []
+
+    def get(self, key, *args, **kwargs):
+        self.reads.append(("get", key))
+        return cache.get(key, *args, **kwargs)
+
+    def get_many(self, keys, *args, **kwargs):
+        self.reads.append(("get_many", list(keys)))
+        return cache.get_many(keys, *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(cache, name)
+
+
+@pytest.mark.django_db
+def test_product_list_etag_not_modified(api_client, product, monkeypatch):
+    url = reverse("products-list")
+    r1 = api_client.get(url)
+    assert r1.status_code == 200
+    etag = r1["ETag"]
+
+    # тот же ETag -> 304 без тела
+    r2 = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert r2.status_code == 304
+    assert r2.content == b""
+
+    # версия свежая в процессе: 304 решается без чтений из Memcached, payload не читаем
+    cache_utils.remember_list_version("products:list:version", cache.get("products:list:version"))
+    monkeypatch.setattr(catalog_views, "cache", _RecordingCache())
+    r304 = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert r304.status_code == 304
+    assert catalog_views.cache.reads == []
+    monkeypatch.undo()
+
+    # после изменения продукта версия списков растёт -> новый ETag и 200
+    product.price = 777
+    product.save()
+    r3 = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert r3.status_code == 200
+    assert r3["ETag"] != etag
+
+
+@pytest.mark.django_db
+def test_product_list_stale_local_version_single_round_trip(api_client, product, monkeypatch):
+    url = reverse("products-list")
+    assert api_client.get(url)["X-Cache"] == "MISS"
+
+    # версия в процессе устарела: версия и payload одним get_many, без отдельного get
+    version, _ = cache_utils._LOCAL_VERSIONS["products:list:version"]
+    cache_utils._LOCAL_VERSIONS["products:list:version"] = (version, 0.0)
+    monkeypatch.setattr(catalog_views, "cache", _RecordingCache())
+    r = api_client.get(url)
+    assert r["X-Cache"] == "HIT"
+    assert [method for method, _ in catalog_views.cache.reads] == ["get_many"]
+
+
+@pytest.mark.django_db
+def test_search_non_ascii_names(api_client):
+    # регрессия: кириллица должна находиться и в SQLite, где LOWER() складывает только ASCII
+    cat = Category.objects.create(name="Электроника", slug="elektronika", is_active=True)
+    Product.objects.create(name="Телевизор", description="d", price=100, stock=1, category=cat, is_active=True)
+
+    r_cat = api_client.get(reverse("categories-list"), {"search": "Электро"})
+    assert r_cat.status_code == 200
+    assert [c["name"] for c in r_cat.json()] == ["Электроника"]
+
+    r_prod = api_client.get(reverse("products-list"), {"search": "Телев"})
+    assert r_prod.status_code == 200
+    assert [p["name"] for p in r_prod.json()] == ["Телевизор"]
+    assert r_prod.json()[0]["category"] == "Электроника"
@@ -1,17 +1,21 @@
 import hashlib
-import random
-from urllib.parse import urlencode
+import time
 
 from django.core.cache import cache
+from django.db import connection
 from django.db.models.functions import Lower
+from django.http import HttpResponse, HttpResponseNotModified
 from django.shortcuts import get_object_or_404
+from django.utils.http import parse_etags
 
 from rest_framework import status, generics, permissions, filters
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from rest_framework.throttling import AnonRateThrottle, UserRateThrottle
 from django_filters.rest_framework import DjangoFilterBackend
 
 from apps.catalog.models import Category, Product
+from online_store.cache_utils import LocalCache, local_list_version, remember_list_version
 from apps.catalog.serializers import (
     CategoryListSerializer,
     CategoryDetailSerializer,
@@ -22,32 +26,110 @@ from apps.catalog.serializers import (
 # ---------- cache utils ----------
 
 def _ttl_with_jitter(base: int = 300, jitter: float = 0.10) -> int:
-    """TTL с анти-догпайлом: ±jitter от базового значения (по умолчанию ±10%)."""
+    """
+    TTL с анти-догпайлом: ±jitter от базового значения (по умолчанию ±10%).
+    Источник разброса — младшие биты time_ns(): криптостойкость не нужна, а random держит лок.
+    """
     delta = int(base * jitter)
-    return base + random.randint(-delta, delta)
+    return base + (time.time_ns() & 0xFFFF) % (2 * delta + 1) - delta
 
 
 def _hash_params(params: dict) -> str:
-    """Стабильный sha256-хэш нормализованных параметров запроса (для ключей кэша)."""
-    encoded = urlencode(sorted(params.items()), doseq=True)
-    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+    """
+    Стабильный blake2b-хэш нормализованных параметров запроса (для ключей кэша).
+    Пустые значения пропускаем; длина значения в префиксе делает кодирование однозначным без urlencode.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    for k, v in sorted(params.items()):
+        if not v:
+            continue
+        raw = str(v).encode("utf-8")
+        h.update(f"{k}:{len(raw)}:".encode("utf-8"))
+        h.update(raw)
+    return h.hexdigest()
 
 
-def _products_list_version() -> int:
+def _list_version(version_key: str) -> int:
     """
-    Версия списков продуктов для кэша.
-    Инкрементируется сигналами при create/update/delete/soft_delete Product.
-    Если версии нет — инициализируем 1 (см. сигнал).
+    Версия списков для кэша. Пока известная процессу версия свежая (см. cache_utils.LOCAL_VERSION_TTL),
+    в Memcached не ходим; иначе читаем версию и запоминаем её.
     """
-    key = "products:list:version"
-    v = cache.get(key)
-    return v if isinstance(v, int) and v > 0 else 1
+    version, fresh = local_list_version(version_key)
+    if fresh:
+        return version
+    v = cache.get(version_key)
+    version = v if isinstance(v, int) and v > 0 else 1
+    remember_list_version(version_key, version)
+    return version
+
+
+# payload ещё не читали (версия свежая в процессе) — в отличие от None, «в кэше пусто»
+_NOT_FETCHED = object()
+
+
+def _get_versioned(version_key: str, key_for) -> tuple[int, str, object]:
+    """
+    Версия списков + ключ payload. Пока известная процессу версия свежая — без round-trip'а, payload
+    не читаем (вью сначала сверяет ETag: на 304 он не нужен), cached = _NOT_FETCHED.
+    Иначе один get_many версии и payload по последней известной версии; если версия в кэше другая —
+    ещё один get по актуальному ключу. Возвращает (version, cache_key, cached | None | _NOT_FETCHED).
+    """
+    guess, fresh = local_list_version(version_key)
+    if fresh:
+        return guess, key_for(guess), _NOT_FETCHED
+
+    guess = guess or 1
+    candidate = key_for(guess)
+    got = cache.get_many([version_key, candidate])
+    v = got.get(version_key)
+    version = v if isinstance(v, int) and v > 0 else 1
+    remember_list_version(version_key, version)
+    if version == guess:
+        return version, candidate, got.get(candidate)
+    cache_key = key_for(version)
+    return version, cache_key, cache.get(cache_key)
 
 
 def _categories_list_version() -> int:
-    key = "categories:list:version"
-    v = cache.get(key)
-    return v if isinstance(v, int) and v > 0 else 1
+    """
+    Версия списков категорий для кэша.
+    Инкрементируется сигналами при create/update/delete/soft_delete Category.
+    """
+    return _list_version("categories:list:version")
+
+
+def _list_etag(version: int, params_hash: str) -> str:
+    """Слабый ETag списка: меняется вместе с версией списков и параметрами запроса."""
+    return f'W/"{version}-{params_hash}"'
+
+
+def _not_modified(request, etag: str):
+    """304 без тела, если клиент прислал актуальный ETag в If-None-Match; иначе None."""
+    if etag not in parse_etags(request.META.get("HTTP_IF_NONE_MATCH", "")):
+        return None
+    resp = HttpResponseNotModified()
+    resp["ETag"] = etag
+    return resp
+
+
+# В кэше лежат готовые JSON-байты: HIT отдаётся как есть, без повторного рендеринга DRF
+_JSON_RENDERER = JSONRenderer()
+
+
+def _json_response(body: bytes, cache_status: str, etag: str | None = None) -> HttpResponse:
+    resp = HttpResponse(body, content_type="application/json")
+    resp["X-Cache"] = cache_status
+    if etag:
+        resp["ETag"] = etag
+    return resp
+
+
+# L1: in-process кэш деталей категорий перед Memcached.
+# Ключ (pk, версия списков категорий): сигналы поднимают версию при любом изменении категории,
+# поэтому запись старой версии просто перестаёт находиться; TTL и лимит размера — страховка.
+# Версию берём из процессного кэша версий (_list_version) — HIT L1 обходится без round-trip'а в Memcached,
+# а изменение категории в другом процессе становится видно не позже чем через LOCAL_VERSION_TTL.
+_CATEGORY_L1 = LocalCache(max_size=512)
 
 
 # ---------- throttling ----------
@@ -62,9 +144,50 @@ class UserCatalogThrottle(UserRateThrottle):
     rate = "240/min"
 
 
+# публичный каталог отдаёт только JSON: без BrowsableAPIRenderer (HTML-шаблоны, reverse() на каждый ответ)
+CATALOG_RENDERERS = [JSONRenderer]
+
+
+# ---------- search ----------
+
+def _search_folds_case() -> bool:
+    """
+    LOWER() в БД приводит к нижнему регистру и не-ASCII (кириллицу) — только в PostgreSQL.
+    В SQLite LOWER/LIKE складывают лишь ASCII, поэтому там терм в Python не понижаем.
+    """
+    return connection.vendor == "postgresql"
+
+
+def _search_key(raw: str | None) -> str:
+    """Нормализованный ?search= для ключа кэша: регистр сворачиваем только там, где его сворачивает БД."""
+    search = (raw or "").strip()
+    return search.lower() if _search_folds_case() else search
+
+
+class LowerNameSearchMixin:
+    """
+    Поиск ?search= по имени. В PostgreSQL — LOWER(name) LIKE '%term%' через alias _lname: то же выражение,
+    что в ORDER BY и в trigram-индексах по LOWER(name). В остальных БД — name__icontains, как у SearchFilter
+    (LOWER в SQLite не трогает кириллицу, и понижённый терм не совпал бы с исходным именем).
+    Термы делим как SearchFilter (пробелы/запятые) и объединяем по AND.
+    SearchFilter остаётся в filter_backends ради описания параметра в схеме OpenAPI.
+    """
+
+    def filter_queryset(self, queryset):
+        search = self.request.query_params.get("search") or ""
+        terms = search.replace(",", " ").split()
+        if _search_folds_case():
+            for term in terms:
+                queryset = queryset.filter(_lname__contains=term.lower())
+        else:
+            for term in terms:
+                queryset = queryset.filter(name__icontains=term)
+        return queryset
+
+
 # ---------- categories ----------
 
-class CategoryListView(generics.ListAPIView):
+class CategoryListView(LowerNameSearchMixin, generics.ListAPIView):
     """
     GET /api/v1/categories/
     Назначение:
@@ -72,39 +195,48 @@ class CategoryListView(generics.ListAPIView):
     Функционал:
       - поиск по name (?search=..., регистр не важен);
       - ручной кэш Memcached с ключом, учитывающим параметры;
-      - заголовок X-Cache: HIT|MISS.
+      - заголовок X-Cache: HIT|MISS;
+      - ETag из версии списков и параметров, If-None-Match → 304 без тела.
+    Ответ:
+      - [{id, name, slug}] — created_at/updated_at в списке не отдаём, они есть в детали категории.
     """
     serializer_class = CategoryListSerializer
     throttle_classes = [AnonCatalogThrottle, UserCatalogThrottle]
+    renderer_classes = CATALOG_RENDERERS
     filter_backends = [filters.SearchFilter]
     search_fields = ['name']
     pagination_class = None  # по ТЗ: без пагинации
 
     def get_queryset(self):
-        return Category.objects.filter(is_active=True).order_by(Lower('name'))
+        return Category.objects.filter(is_active=True).alias(_lname=Lower('name')).order_by('_lname')
 
     def list(self, request, *args, **kwargs):
         # нормализуем параметры для ключа кэша
         params = {
-            "search": (request.query_params.get("search") or "").strip().lower(),
+            "search": _search_key(request.query_params.get("search")),
         }
-        version = _categories_list_version()
-        cache_key = f"categories:list:v{version}:{_hash_params(params)}"
-
-        cached = cache.get(cache_key)
-        if cached is not None:
-            resp = Response(cached)
-            resp["X-Cache"] = "HIT"
-            return resp
-
+        params_hash = _hash_params(params)
+        # при свежей версии в процессе payload читаем только после сверки ETag (на 304 он не нужен);
+        # при устаревшей — версия и payload одним get_many
+        version, cache_key, cached = _get_versioned(
+            "categories:list:version", lambda v: f"categories:list:v{v}:{params_hash}"
+        )
+        etag = _list_etag(version, params_hash)
+        not_modified = _not_modified(request, etag)
+        if not_modified is not None:
+            return not_modified
+        if cached is _NOT_FETCHED:
+            cached = cache.get(cache_key)
+        if isinstance(cached, bytes):
+            return _json_response(cached, "HIT", etag)
+
+        # .values() + dict вместо ModelSerializer(many=True): без привязки полей на каждый объект
         queryset = self.filter_queryset(self.get_queryset())
-        serializer = self.get_serializer(queryset, many=True)
-        data = serializer.data
+        data = list(queryset.values("id", "name", "slug"))
 
-        cache.set(cache_key, data, timeout=_ttl_with_jitter(300, 0.10))
-        resp = Response(data)
-        resp["X-Cache"] = "MISS"
-        return resp
+        body = _JSON_RENDERER.render(data)
+        cache.set(cache_key, body, timeout=_ttl_with_jitter(300, 0.10))
+        return _json_response(body, "MISS", etag)
 
 
 class CategoryView(generics.RetrieveAPIView):
@@ -118,10 +250,12 @@ class CategoryView(generics.RetrieveAPIView):
       - GET: неактивные (is_active=False) не выдаём → 404.
       - DELETE: по умолчанию soft (is_active=False); hard — только с ?hard=true и если нет связанных продуктов.
     Кэш:
-      - GET: ключ category:{id}, TTL 5 минут ±10%, X-Cache: HIT|MISS.
+      - GET: L1 в памяти процесса (ключ (id, версия списков категорий)) → Memcached category:{id},
+        TTL 5 минут ±10%, X-Cache: HIT|MISS.
     """
     serializer_class = CategoryDetailSerializer
     throttle_classes = [AnonCatalogThrottle, UserCatalogThrottle]
+    renderer_classes = CATALOG_RENDERERS
     lookup_field = "pk"
 
     def get_permissions(self):
@@ -131,24 +265,35 @@ class CategoryView(generics.RetrieveAPIView):
 
     def get(self, request, *args, **kwargs):
         pk = kwargs.get("pk")
+        l1_key = (pk, _categories_list_version())
+        cached = _CATEGORY_L1.get(l1_key)
+        if cached is not None:
+            return _json_response(cached, "HIT")
+
         cache_key = f"category:{pk}"
         cached = cache.get(cache_key)
-        if cached is not None:
-            resp = Response(cached)
-            resp["X-Cache"] = "HIT"
-            return resp
-        instance = get_object_or_404(Category, pk=pk, is_active=True)
+        # только готовые JSON-байты; dict старого формата (до деплоя) — промах
+        if isinstance(cached, bytes):
+            _CATEGORY_L1.set(l1_key, cached, _ttl_with_jitter(300, 0.10))
+            return _json_response(cached, "HIT")
+        instance = get_object_or_404(
+            Category.objects.only("id", "name", "slug", "is_active", "created_at", "updated_at"),
+            pk=pk,
+            is_active=True,
+        )
         data = self.get_serializer(instance).data
-        cache.set(cache_key, data, timeout=_ttl_with_jitter(300, 0.10))
-        resp = Response(data)
-        resp["X-Cache"] = "MISS"
-        return resp
+        body = _JSON_RENDERER.render(data)
+        ttl = _ttl_with_jitter(300, 0.10)
+        cache.set(cache_key, body, timeout=ttl)
+        _CATEGORY_L1.set(l1_key, body, ttl)
+        return _json_response(body, "MISS")
 
     def delete(self, request, pk, *args, **kwargs):
         category = get_object_or_404(Category, pk=pk)
         hard = str(request.query_params.get("hard", "false")).lower() in ("1", "true", "yes")
         if hard:
-            if category.products.exists():
+            # EXISTS по category_id — ведущей колонке составного индекса (category, is_active, -created_at)
+            if Product.objects.filter(category_id=category.pk).exists():
                 return Response(
                     {"detail": "Категория содержит продукты, удаление невозможно", "code": "category_in_use"},
                     status=status.HTTP_400_BAD_REQUEST,
@@ -161,7 +306,10 @@ class CategoryView(generics.RetrieveAPIView):
 
 # ---------- products ----------
 
-class ProductListView(generics.ListAPIView):
+PRODUCT_LIST_LIMIT = 10_000
+
+
+class ProductListView(LowerNameSearchMixin, generics.ListAPIView):
     """
     GET /api/v1/products/
     Назначение:
@@ -173,12 +321,15 @@ class ProductListView(generics.ListAPIView):
           * ?price_min=<num> (price__gte)
           * ?price_max=<num> (price__lte)
       - сортировка по name (ASC);
+      - не более PRODUCT_LIST_LIMIT (10 000) позиций — предохранитель для эндпоинта без пагинации;
       - ручной кэш Memcached: ключ = products:list:v{N}:{hash(filters)}, TTL 5 минут ±10%;
-      - заголовок X-Cache: HIT|MISS.
+      - заголовок X-Cache: HIT|MISS;
+      - ETag из версии списков и параметров, If-None-Match → 304 без тела.
     Ответ (по текущему сериализатору):
       - [{id, name, price, category}] — category = имя категории.
     """
     throttle_classes = [AnonCatalogThrottle, UserCatalogThrottle]
+    renderer_classes = CATALOG_RENDERERS
     serializer_class = ProductListSerializer
     filter_backends = [filters.SearchFilter, DjangoFilterBackend]
     search_fields = ['name']
@@ -188,24 +339,19 @@ class ProductListView(generics.ListAPIView):
         """
         Базовый queryset:
           - только активные товары,
-          - подгружаем категорию (select_related) чтобы не было N+1,
+          - имя категории берём из денормализованного category_name (без JOIN),
           - сортируем по name.
         """
-        return (
-            Product.objects.filter(is_active=True)
-            .select_related('category')
-            .order_by(Lower('name'))
-        )
+        return Product.objects.filter(is_active=True).alias(_lname=Lower('name')).order_by('_lname')
 
     def list(self, request, *args, **kwargs):
         # Собираем и нормализуем параметры фильтрации/поиска для ключа кэша
-        search = (request.query_params.get("search") or "").strip().lower()
+        search = _search_key(request.query_params.get("search"))
         category_id = (request.query_params.get("category") or "").strip()
         category_slug = (request.query_params.get("category_slug") or "").strip().lower()
         price_min = (request.query_params.get("price_min") or "").strip()
         price_max = (request.query_params.get("price_max") or "").strip()
 
-        version = _products_list_version()
         params = {
             "search": search,
             "category": category_id,
@@ -213,13 +359,20 @@ class ProductListView(generics.ListAPIView):
             "price_min": price_min,
             "price_max": price_max,
         }
-        cache_key = f"products:list:v{version}:{_hash_params(params)}"
-
-        cached = cache.get(cache_key)
-        if cached is not None:
-            resp = Response(cached)
-            resp["X-Cache"] = "HIT"
-            return resp
+        params_hash = _hash_params(params)
+        # при свежей версии в процессе payload читаем только после сверки ETag (на 304 он не нужен);
+        # при устаревшей — версия и payload одним get_many
+        version, cache_key, cached = _get_versioned(
+            "products:list:version", lambda v: f"products:list:v{v}:{params_hash}"
+        )
+        etag = _list_etag(version, params_hash)
+        not_modified = _not_modified(request, etag)
+        if not_modified is not None:
+            return not_modified
+        if cached is _NOT_FETCHED:
+            cached = cache.get(cache_key)
+        if isinstance(cached, bytes):
+            return _json_response(cached, "HIT", etag)
 
         # Применяем фильтры к queryset
         qs = self.get_queryset()
@@ -238,16 +391,19 @@ class ProductListView(generics.ListAPIView):
             except Exception:
                 pass
 
-        # Поиск по имени через SearchFilter
+        # Поиск по имени (LowerNameSearchMixin)
         qs = self.filter_queryset(qs)
 
-        serializer = self.get_serializer(qs, many=True)
-        data = serializer.data
-        cache.set(cache_key, data, timeout=_ttl_with_jitter(300, 0.10))
-
-        resp = Response(data)
-        resp["X-Cache"] = "MISS"
-        return resp
+        # .values() + dict вместо ModelSerializer(many=True); контракт тот же, что у ProductListSerializer
+        # iterator(): строки читаем чанками с курсора, без промежуточного кэша моделей в памяти
+        rows = qs.values("id", "name", "price", "category_name")[:PRODUCT_LIST_LIMIT].iterator(chunk_size=500)
+        data = [
+            {"id": r["id"], "name": r["name"], "price": str(r["price"]), "category": r["category_name"]}
+            for r in rows
+        ]
+        body = _JSON_RENDERER.render(data)
+        cache.set(cache_key, body, timeout=_ttl_with_jitter(300, 0.10))
+        return _json_response(body, "MISS", etag)
 
 
 class ProductDetailView(generics.RetrieveAPIView):
@@ -262,6 +418,7 @@ class ProductDetailView(generics.RetrieveAPIView):
     """
     serializer_class = ProductDetailSerializer
     throttle_classes = [AnonCatalogThrottle, UserCatalogThrottle]
+    renderer_classes = CATALOG_RENDERERS
     lookup_field = "pk"
 
     def retrieve(self, request, *args, **kwargs):
@@ -269,18 +426,20 @@ class ProductDetailView(generics.RetrieveAPIView):
         cache_key = f"product:{pk}"
 
         cached = cache.get(cache_key)
-        if cached is not None:
-            resp = Response(cached)
-            resp["X-Cache"] = "HIT"
-            return resp
+        # только готовые JSON-байты; dict старого формата (до деплоя) — промах
+        if isinstance(cached, bytes):
+            return _json_response(cached, "HIT")
 
         # Публичный контракт: неактивные продукты в публичном API не выдаём
-        instance = get_object_or_404(Product.objects.select_related("category"), pk=pk, is_active=True)
+        # только колонки, которые отдаёт ProductDetailSerializer
+        queryset = Product.objects.select_related("category").only(
+            "id", "name", "description", "price", "stock", "is_active", "created_at", "updated_at",
+            "category", "category__name", "category__slug",
+        )
+        instance = get_object_or_404(queryset, pk=pk, is_active=True)
 
         serializer = self.get_serializer(instance)
         data = serializer.data
-        cache.set(cache_key, data, timeout=_ttl_with_jitter(300, 0.10))
-
-        resp = Response(data)
-        resp["X-Cache"] = "MISS"
-        return resp
+        body = _JSON_RENDERER.render(data)
+        cache.set(cache_key, body, timeout=_ttl_with_jitter(300, 0.10))
+        return _json_response(body, "MISS")
@@ -1,11 +1,18 @@
 # apps/orders/admin.py
+from decimal import Decimal
+from functools import partial
+
 from django import forms
 from django.contrib import admin, messages
-from django.core.exceptions import ValidationError
-from django.db.models import Count
+from django.db import transaction
+from django.db.models import Count, DecimalField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from django.utils.html import format_html
 
+from . import tasks
 from .models import Order, OrderItem
+from .signals import invalidate_orders
 
 
 # --- Inline form: блокируем правку price_at_purchase на существующих строках ---
@@ -30,12 +37,20 @@ class OrderItemInline(admin.TabularInline):
     fields = ("product", "quantity", "price_at_purchase", "created_at")
     readonly_fields = ("created_at",)
 
-    # Разрешённый набор продуктов: только активные и с остатком
+    # Разрешённый набор продуктов: только активные и с остатком.
+    # Queryset строим один раз на запрос (поле создаётся для каждой строки инлайна);
+    # проверка на None, а не `or`: bool(queryset) выполнил бы лишний SELECT.
     def formfield_for_foreignkey(self, db_field, request, **kwargs):
         if db_field.name == "product":
-            from apps.catalog.models import Product  # локальный импорт, чтобы избежать циклов
-            qs = kwargs.get("queryset") or Product.objects.all()
-            kwargs["queryset"] = qs.filter(is_active=True, stock__gt=0)
+            qs = getattr(request, "_active_products_qs", None)
+            if qs is None:
+                from apps.catalog.models import Product  # локальный импорт, чтобы избежать циклов
+                qs = kwargs.get("queryset")
+                if qs is None:
+                    qs = Product.objects.all()
+                qs = qs.filter(is_active=True, stock__gt=0).only("id", "name", "price", "stock")
+                request._active_products_qs = qs
+            kwargs["queryset"] = qs
         return super().formfield_for_foreignkey(db_field, request, **kwargs)
 
     def has_add_permission(self, request, obj=None):
@@ -48,20 +63,27 @@ class OrderItemInline(admin.TabularInline):
         return False if (obj and obj.is_readonly) else super().has_delete_permission(request, obj)
 
 
+# цвета и подписи статусов для changelist — собираем один раз, а не на каждую строку
+_STATUS_COLORS = {
+    Order.STATUS_PENDING: "#888",
+    Order.STATUS_PROCESSING: "#0a7",
+    Order.STATUS_SHIPPED: "#06c",
+    Order.STATUS_DELIVERED: "#3a3",
+    Order.STATUS_CANCELLED: "#c33",
+}
+_STATUS_LABELS = dict(Order.STATUS_CHOICES)
+
+
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
     # Красивый цветной статус в списке
     @admin.display(description="Статус")
     def colored_status(self, obj):
-        colors = {
-            Order.STATUS_PENDING: "#888",
-            Order.STATUS_PROCESSING: "#0a7",
-            Order.STATUS_SHIPPED: "#06c",
-            Order.STATUS_DELIVERED: "#3a3",
-            Order.STATUS_CANCELLED: "#c33",
-        }
-        c = colors.get(obj.status, "#555")
-        return format_html('<b style="color:{}">{}</b>', c, obj.get_status_display())
+        return format_html(
+            '<b style="color:{}">{}</b>',
+            _STATUS_COLORS.get(obj.status, "#555"),
+            _STATUS_LABELS.get(obj.status, obj.status),
+        )
 
     list_display = ("id", "user", "colored_status", "items_count", "total_price", "created_at")
     list_filter = ("status", "created_at")
@@ -81,21 +103,39 @@ class OrderAdmin(admin.ModelAdmin):
 
     def get_queryset(self, request):
         qs = super().get_queryset(request)
-        return qs.select_related("user").annotate(_items_count=Count("items"))
-
-    @admin.display(ordering="_items_count", description="Позиций")
-    def items_count(self, obj):
-        return getattr(obj, "_items_count", 0)
-
-    # Разрешённый набор пользователей: только активные
+        # items_count — колонка Order (см. recalc_total), без COUNT/GROUP BY по позициям
+        qs = qs.select_related("user")
+        match = getattr(request, "resolver_match", None)
+        if match and match.url_name and match.url_name.endswith("_changelist"):
+            # changelist показывает несколько колонок — остальное (в т.ч. строку пользователя) не тянем;
+            # форме изменения нужен полный объект
+            qs = qs.only(
+                "id", "status", "total_price", "items_count", "created_at",
+                "user", "user__id", "user__username", "user__email",
+            )
+        return qs
+
+    # Разрешённый набор пользователей: только активные (queryset — один на запрос, как у продуктов в инлайне)
     def formfield_for_foreignkey(self, db_field, request, **kwargs):
         if db_field.name == "user":
-            qs = kwargs.get("queryset") or self.model._meta.get_field("user").remote_field.model.objects.all()
-            kwargs["queryset"] = qs.filter(is_active=True)
+            qs = getattr(request, "_active_users_qs", None)
+            if qs is None:
+                qs = kwargs.get("queryset")
+                if qs is None:
+                    qs = self.model._meta.get_field("user").remote_field.model.objects.all()
+                qs = qs.filter(is_active=True)
+                request._active_users_qs = qs
+            kwargs["queryset"] = qs
         return super().formfield_for_foreignkey(db_field, request, **kwargs)
 
+    def save_formset(self, request, form, formset, change):
+        super().save_formset(request, form, formset, change)
+        # состав мог измениться — пересчитываем total и items_count один раз на весь инлайн, а не на каждую строку
+        if formset.model is OrderItem:
+            form.instance.recalc_total(save=True)
+
     def get_readonly_fields(self, request, obj=None):
-        base_ro = {"total_price", "created_at", "updated_at"}
+        base_ro = {"total_price", "items_count", "created_at", "updated_at"}
         if obj and obj.is_readonly:
             return tuple(sorted({f.name for f in obj._meta.fields} | base_ro))
         return tuple(sorted(base_ro))
@@ -112,25 +152,49 @@ class OrderAdmin(admin.ModelAdmin):
                 actions.pop(a, None)
         return actions
 
-    # --- массовая смена статуса с проверкой переходов через clean() ---
+    # --- массовая смена статуса: один UPDATE по тем заказам, для которых переход разрешён ---
     def _bulk_set_status(self, request, queryset, new_status, label):
-        ok = fail = 0
-        for order in queryset:
-            old = order.status
-            order.status = new_status
-            try:
-                order.full_clean()  # проверяет валидный переход и инварианты
-                order.save(update_fields=["status", "updated_at"])
-                ok += 1
-            except ValidationError as e:
-                fail += 1
-                self.message_user(
-                    request,
-                    f"Заказ #{order.pk}: запрещён переход {old} → {new_status}. {e}",
-                    level=messages.WARNING,
+        # из каких статусов разрешён переход в new_status (см. Order.VALID_TRANSITIONS)
+        allowed_old = [old for old, targets in Order.VALID_TRANSITIONS.items() if new_status in targets]
+
+        rejected = queryset.exclude(status__in=[*allowed_old, new_status]).values_list("pk", "status")
+        fail = 0
+        for pk, old in rejected:
+            fail += 1
+            self.message_user(
+                request,
+                f"Заказ #{pk}: запрещён переход {old} → {new_status}.",
+                level=messages.WARNING,
+            )
+        already = queryset.filter(status=new_status).count()
+
+        with transaction.atomic():
+            # строки блокируем до UPDATE — между выборкой и записью статус не сменит параллельный запрос
+            rows = list(queryset.filter(status__in=allowed_old).select_for_update().values_list("pk", "user_id"))
+            pks = [pk for pk, _ in rows]
+            updated = []
+            if pks:
+                # status__in повторно — защита от гонки там, где SELECT ... FOR UPDATE не блокирует (SQLite)
+                ok = Order.objects.filter(pk__in=pks, status__in=allowed_old).update(
+                    status=new_status, updated_at=timezone.now()
                 )
-        if ok:
-            self.message_user(request, f"{label}: успешно — {ok}", level=messages.SUCCESS)
+                if ok != len(rows):
+                    # часть строк ушла из allowed_old — переведёнными считаем только те, что теперь в new_status
+                    moved = set(Order.objects.filter(pk__in=pks, status=new_status).values_list("pk", flat=True))
+                    rows = [row for row in rows if row[0] in moved]
+                updated = [pk for pk, _ in rows]
+            if updated:
+                # .update() не шлёт post_save — инвалидируем кэш сами, только по реально изменённым заказам
+                invalidate_orders(updated, {user_id for _, user_id in rows})
+                if new_status == Order.STATUS_SHIPPED:
+                    # одно сообщение в брокер на всю пачку вместо задачи на каждый заказ; после коммита UPDATE.
+                    # Только реально переведённые: заказ, отменённый параллельно, уведомление об отправке не получит
+                    transaction.on_commit(partial(tasks.order_shipped_notify_batch.delay, updated))
+
+        if updated:
+            self.message_user(request, f"{label}: успешно — {len(updated)}", level=messages.SUCCESS)
+        if already:
+            self.message_user(request, f"{label}: уже в статусе {new_status} — {already}", level=messages.INFO)
         if fail:
             self.message_user(request, f"{label}: отклонено — {fail}", level=messages.WARNING)
 
@@ -154,10 +218,23 @@ class OrderAdmin(admin.ModelAdmin):
 
     mark_cancelled.short_description = "Отменить заказы"
 
-    # --- пересчёт total (на случай рассинхронизаций) ---
+    # --- пересчёт total (на случай рассинхронизаций): один UPDATE с коррелированными подзапросами ---
     def recalc_totals(self, request, queryset):
-        for order in queryset:
-            order.recalc_total(save=True)
-        self.message_user(request, f"Пересчитано заказов: {queryset.count()}", level=messages.SUCCESS)
+        money = DecimalField(max_digits=10, decimal_places=2)
+        items = OrderItem.objects.filter(order=OuterRef("pk")).order_by().values("order")
+        total = items.annotate(s=Sum(F("quantity") * F("price_at_purchase"), output_field=money)).values("s")
+        count = items.annotate(c=Count("pk")).values("c")
+
+        with transaction.atomic():
+            # блокируем выбранные заказы: инвалидируем ровно те строки, что пересчитал UPDATE
+            rows = list(queryset.select_for_update().values_list("pk", "user_id"))
+            pks = [pk for pk, _ in rows]
+            updated = Order.objects.filter(pk__in=pks).update(
+                total_price=Coalesce(Subquery(total), Value(Decimal("0.00"), output_field=money)),
+                items_count=Coalesce(Subquery(count), Value(0)),
+            )
+            # .update() не шлёт post_save — инвалидируем кэш сами
+            invalidate_orders(pks, {user_id for _, user_id in rows})
+        self.message_user(request, f"Пересчитано заказов: {updated}", level=messages.SUCCESS)
 
     recalc_totals.short_description = "Пересчитать итоги (total_price)"
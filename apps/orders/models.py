@@ -3,7 +3,7 @@ from decimal import Decimal
 from django.db import models
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
-from django.db.models import F, Sum, DecimalField, Value
+from django.db.models import Count, F, Sum, DecimalField, Value
 from django.db.models.functions import Coalesce
 
 from apps.catalog.models import Product  # важно: используем каталог
@@ -26,9 +26,20 @@ class Order(models.Model):
         (STATUS_CANCELLED, 'Cancelled'),
     ]
 
+    # допустимые переходы: текущий статус → куда можно перевести
+    VALID_TRANSITIONS = {
+        STATUS_PENDING: (STATUS_PROCESSING, STATUS_CANCELLED),
+        STATUS_PROCESSING: (STATUS_SHIPPED, STATUS_CANCELLED),
+        STATUS_SHIPPED: (STATUS_DELIVERED,),
+        STATUS_DELIVERED: (),
+        STATUS_CANCELLED: (),
+    }
+
     user = models.ForeignKey(User, on_delete=models.PROTECT, related_name='orders')
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING)
     total_price = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    # денормализованное число позиций: списки читают колонку вместо COUNT/GROUP BY по items
+    items_count = models.PositiveIntegerField(default=0, editable=False)
     products = models.ManyToManyField(Product, through='OrderItem', related_name='orders')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -40,26 +51,30 @@ class Order(models.Model):
             models.Index(fields=['status', '-created_at']),
         ]
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # статус на момент загрузки — clean() сверяет переход без лишнего SELECT (None, если отложен)
+        instance._loaded_status = instance.__dict__.get('status')
+        return instance
+
     def clean(self):
         """Валидируем переход статуса и инварианты."""
-        valid_transitions = {
-            self.STATUS_PENDING: [self.STATUS_PROCESSING, self.STATUS_CANCELLED],
-            self.STATUS_PROCESSING: [self.STATUS_SHIPPED, self.STATUS_CANCELLED],
-            self.STATUS_SHIPPED: [self.STATUS_DELIVERED],
-            self.STATUS_DELIVERED: [],
-            self.STATUS_CANCELLED: [],
-        }
         if self.pk:
-            old_status = type(self).objects.only('status').get(pk=self.pk).status
-            if self.status != old_status and self.status not in valid_transitions[old_status]:
+            # статус из БД запомнен в from_db/save; запрос — только для инстансов, собранных не из БД
+            old_status = getattr(self, '_loaded_status', None)
+            if old_status is None:
+                old_status = type(self).objects.only('status').get(pk=self.pk).status
+            if self.status != old_status and self.status not in self.VALID_TRANSITIONS[old_status]:
                 raise ValidationError(f"Невозможно изменить статус {old_status} → {self.status}")
 
         if self.total_price < 0:
             raise ValidationError("total_price не может быть меньше 0")
 
     def recalc_total(self, save: bool = True):
-        """Пересчёт total_price: Σ(quantity * price_at_purchase)."""
+        """Пересчёт total_price: Σ(quantity * price_at_purchase) и items_count — одним агрегатом."""
         agg = self.items.aggregate(
+            c=Count('id'),
             s=Coalesce(
                 Sum(
                     F('quantity') * F('price_at_purchase'),
@@ -69,9 +84,12 @@ class Order(models.Model):
             )
         )
         self.total_price = agg['s']
+        self.items_count = agg['c']
         if save:
-            # избегаем рекурсии save↔items: сохраняем только поле total_price
-            type(self).objects.filter(pk=self.pk).update(total_price=self.total_price)
+            # избегаем рекурсии save↔items: сохраняем только total_price/items_count
+            type(self).objects.filter(pk=self.pk).update(
+                total_price=self.total_price, items_count=self.items_count
+            )
 
     def save(self, *args, **kwargs):
         """
@@ -82,6 +100,7 @@ class Order(models.Model):
           3) order.recalc_total()
         """
         super().save(*args, **kwargs)
+        self._loaded_status = self.status
 
     @property
     def is_readonly(self):
@@ -106,6 +125,13 @@ class OrderItem(models.Model):
             models.Index(fields=['product']),
         ]
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # «исторические» поля на момент загрузки — save() сверяет их без лишнего SELECT
+        instance._loaded = (instance.__dict__.get('product_id'), instance.__dict__.get('price_at_purchase'))
+        return instance
+
     def clean(self):
         """Запрет изменений состава, если статус финальный."""
         if self.order.is_readonly:
@@ -119,15 +145,15 @@ class OrderItem(models.Model):
                 self.price_at_purchase = self.product.price
         else:
             # запрещаем менять «исторические» поля
-            old = type(self).objects.only('product_id', 'price_at_purchase').get(pk=self.pk)
-            if self.product_id != old.product_id:
+            old_product_id, old_price = getattr(self, '_loaded', (None, None))
+            if old_product_id is None or old_price is None:
+                old = type(self).objects.only('product_id', 'price_at_purchase').get(pk=self.pk)
+                old_product_id, old_price = old.product_id, old.price_at_purchase
+            if self.product_id != old_product_id:
                 raise ValidationError("Нельзя менять продукт в существующей позиции заказа")
-            if self.price_at_purchase != old.price_at_purchase:
+            if self.price_at_purchase != old_price:
                 raise ValidationError("Нельзя менять price_at_purchase в существующей позиции заказа")
 
+        # total заказа здесь не пересчитываем (SUM + UPDATE на каждую строку): вызывающий код делает
+        # order.recalc_total() один раз после изменения состава — см. OrderAdmin.save_formset
         super().save(*args, **kwargs)
-
-        # после изменения состава — пересчитать total заказа
-        # (делаем только если у order уже есть pk)
-        if self.order_id:
-            self.order.recalc_total(save=True)
@@ -1,13 +1,15 @@
-from collections import defaultdict
+from decimal import Decimal
+from functools import partial
 
 from django.db import transaction
-from django.db.models import F
-from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Case, F, IntegerField, Q, When
+from django.utils import timezone
 from rest_framework import serializers
 
 from apps.catalog.models import Product
 from apps.orders.models import Order, OrderItem
 from apps.orders import tasks
+from apps.orders.signals import invalidate_order_lists, invalidate_orders
 
 
 # ---------- ВСПОМОГАТЕЛЬНЫЕ ----------
@@ -40,13 +42,24 @@ class OrderItemReadSerializer(serializers.ModelSerializer):
 
 # ---------- СОЗДАНИЕ ЗАКАЗА ----------
 
+def _stock_errors(items, stock_by_id: dict) -> list:
+    """Позиции, на которые не хватает остатка: [{product_id, available, requested}, ...]."""
+    errors = []
+    for it in items:
+        available, requested = stock_by_id[it["product_id"]], it["quantity"]
+        if available < requested:
+            errors.append({"product_id": int(it["product_id"]), "available": int(available), "requested": int(requested)})
+    return errors
+
+
 class OrderCreateSerializer(serializers.Serializer):
     """
     Создание заказа:
       - принимает список позиций [{product_id, quantity}, ...]
       - агрегирует дубликаты product_id
-      - в транзакции: select_for_update по продуктам, проверка stock, списание, создание Order + OrderItem[]
-      - пересчитывает total_price через order.recalc_total()
+      - в транзакции: чтение продуктов без блокировок, проверка stock, списание одним guard-UPDATE
+        (оптимистично: stock >= qty в WHERE, число строк сверяем с числом позиций), создание Order + OrderItem[]
+      - считает total_price в памяти по прочитанным ценам
       - триггерит Celery-задачу генерации PDF и "отправки" email
     """
     items = OrderItemInputSerializer(many=True)
@@ -54,10 +67,15 @@ class OrderCreateSerializer(serializers.Serializer):
     def validate_items(self, items):
         if not items:
             raise serializers.ValidationError("Список позиций пуст.")
-        aggregated = defaultdict(int)
+        # агрегируем дубликаты product_id за один проход, сразу в итоговые dict-ы
+        seen = {}
         for it in items:
-            aggregated[it["product_id"]] += it["quantity"]
-        return [{"product_id": pid, "quantity": qty} for pid, qty in aggregated.items()]
+            pid = it["product_id"]
+            if pid in seen:
+                seen[pid]["quantity"] += it["quantity"]
+            else:
+                seen[pid] = {"product_id": pid, "quantity": it["quantity"]}
+        return list(seen.values())
 
     def create(self, validated_data):
         user = self.context["request"].user
@@ -66,11 +84,13 @@ class OrderCreateSerializer(serializers.Serializer):
         product_ids = [i["product_id"] for i in items]
 
         with transaction.atomic():
-            # блокируем продукты для исключения гонок (уникальные id)
+            # читаем продукты без select_for_update: гонки за остаток ловит guard-UPDATE ниже,
+            # и покупатели одного товара не ждут блокировок друг друга
+            # только нужные колонки: id/цена/остаток (описание и прочее при оформлении не читаем)
             products_qs = (
                 Product.objects
-                .select_for_update()
                 .filter(pk__in=set(product_ids), is_active=True)
+                .only("id", "price", "stock", "is_active")
             )
             products_by_id = {p.id: p for p in products_qs}
 
@@ -81,56 +101,87 @@ class OrderCreateSerializer(serializers.Serializer):
                     "items": [f"Продукт(ы) не найдены или неактивны: {sorted(missing)}"]
                 })
 
-            # проверка stock
-            errors = []
-            for it in items:
-                prod = products_by_id[it["product_id"]]
-                requested = it["quantity"]
-                if prod.stock < requested:
-                    errors.append(
-                        {"product_id": int(prod.pk), "available": int(prod.stock), "requested": int(requested)}
-                    )
+            # проверка stock по прочитанным данным — явную нехватку отсекаем без записи
+            errors = _stock_errors(items, {pid: p.stock for pid, p in products_by_id.items()})
             if errors:
                 raise PlainBadRequest({
                     "stock": "Недостаточно товара на складе",
                     "details": errors,
                 })
 
-            # создаём заказ
-            order = Order.objects.create(user=user, status=Order.STATUS_PENDING)
+            # списываем stock одним UPDATE ... SET stock = CASE id WHEN ... END
+            # WHERE is_active AND ((id = a AND stock >= qa) OR ...): всё или ничего
+            stock_whens = []
+            guard = Q()
+            for it in items:
+                pid, qty = it["product_id"], it["quantity"]
+                stock_whens.append(When(pk=pid, then=F("stock") - qty))
+                guard |= Q(pk=pid, stock__gte=qty)
+            updated = Product.objects.filter(guard, is_active=True).update(
+                stock=Case(*stock_whens, output_field=IntegerField())
+            )
+            if updated != len(items):
+                # параллельный заказ успел раньше: исключение откатывает транзакцию, ответ — по свежим данным
+                fresh = dict(
+                    Product.objects.filter(pk__in=products_by_id.keys(), is_active=True).values_list("pk", "stock")
+                )
+                missing = sorted(set(products_by_id.keys()) - set(fresh.keys()))
+                if missing:
+                    raise PlainBadRequest({
+                        "items": [f"Продукт(ы) не найдены или неактивны: {missing}"]
+                    })
+                raise PlainBadRequest({
+                    "stock": "Недостаточно товара на складе",
+                    "details": _stock_errors(items, fresh),
+                })
+
+            # total и число позиций считаем в памяти (цены и количества уже есть) и создаём заказ сразу с ними:
+            # без SUM-агрегата и UPDATE после вставки позиций
+            total = sum(
+                (products_by_id[it["product_id"]].price * it["quantity"] for it in items),
+                Decimal("0.00"),
+            )
+            order = Order(user=user, status=Order.STATUS_PENDING, total_price=total, items_count=len(items))
+            # кэш инвалидируем явно одним вызовом после коммита (см. ниже), а не сигналами
+            order._skip_cache_signal = True
+            order.save()
 
-            # списываем stock и создаём позиции
             order_items = []
             for it in items:
                 prod = products_by_id[it["product_id"]]
                 qty = it["quantity"]
-
-                Product.objects.filter(pk=prod.pk).update(stock=F("stock") - qty)
                 prod.stock -= qty  # локально тоже уменьшим
-
                 order_items.append(
                     OrderItem(order=order, product=prod, quantity=qty, price_at_purchase=prod.price)
                 )
             OrderItem.objects.bulk_create(order_items)
 
-            # пересчёт total
-            order.recalc_total(save=True)
+            # детерминированная инвалидация: один bump списков, независимо от числа позиций;
+            # детали нового заказа в кэше ещё нет — удалять нечего
+            invalidate_order_lists(user.pk)
+            # Celery: PDF + имитация email — только после коммита, иначе воркер может не увидеть заказ
+            transaction.on_commit(partial(tasks.order_created_generate_pdf_and_email.delay, order.id))
 
-        # Celery: PDF + имитация email
-        tasks.order_created_generate_pdf_and_email.delay(order.id)
         return order
 
 
 # ---------- ЧТЕНИЕ ЗАКАЗОВ ----------
 
-class OrderListSerializer(serializers.ModelSerializer):
-    """Список заказов (кратко)."""
-    items_count = serializers.IntegerField(source="items.count", read_only=True)
+# поля списка заказов: вью выбирают их через values() и отдают сериализатору dict-ы
+ORDER_LIST_FIELDS = ("id", "status", "total_price", "created_at", "updated_at", "items_count")
 
-    class Meta:
-        model = Order
-        fields = ("id", "status", "total_price", "created_at", "updated_at", "items_count")
-        read_only_fields = fields
+
+class OrderListSerializer(serializers.Serializer):
+    """
+    Список заказов (кратко) — по dict-ам из values(ORDER_LIST_FIELDS), без инстансов Order.
+    items_count — денормализованная колонка Order, без COUNT по items.
+    """
+    id = serializers.IntegerField(read_only=True)
+    status = serializers.CharField(read_only=True)
+    total_price = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
+    created_at = serializers.DateTimeField(read_only=True)
+    updated_at = serializers.DateTimeField(read_only=True)
+    items_count = serializers.IntegerField(read_only=True)
 
 
 class OrderDetailSerializer(serializers.ModelSerializer):
@@ -148,7 +199,8 @@ class OrderDetailSerializer(serializers.ModelSerializer):
 class OrderStatusPatchSerializer(serializers.ModelSerializer):
     """
     Обновление статуса (PATCH).
-    Переходы валидируются на уровне модели (clean()).
+    Переход сверяем с Order.VALID_TRANSITIONS по уже загруженному статусу (без full_clean и его SELECT),
+    пишем одним UPDATE с guard-ом по старому статусу — он же ловит параллельную смену.
     """
 
     class Meta:
@@ -156,14 +208,22 @@ class OrderStatusPatchSerializer(serializers.ModelSerializer):
         fields = ("status",)
 
     def update(self, instance: Order, validated_data):
-        instance.status = validated_data["status"]
-        try:
-            instance.full_clean()  # дергает Order.clean() с валидацией перехода
-        except DjangoValidationError as e:
-            # конвертируем в DRF-валидатор → HTTP 400
-            raise serializers.ValidationError(e.message_dict or {"detail": e.messages})
-
-        instance.save(update_fields=["status", "updated_at"])
-        if instance.status == Order.STATUS_SHIPPED:
-            tasks.order_shipped_notify_external.delay(instance.id)
+        old_status, new_status = instance.status, validated_data["status"]
+        if new_status == old_status:
+            return instance
+        if new_status not in Order.VALID_TRANSITIONS[old_status]:
+            raise serializers.ValidationError({"status": [f"Невозможно изменить статус {old_status} → {new_status}"]})
+
+        now = timezone.now()
+        updated = Order.objects.filter(pk=instance.pk, status=old_status).update(status=new_status, updated_at=now)
+        if not updated:
+            raise serializers.ValidationError({"status": ["Статус заказа уже изменён, обновите данные"]})
+        instance.status, instance.updated_at = new_status, now
+        instance._loaded_status = new_status
+
+        # .update() не шлёт post_save — инвалидируем кэш сами
+        invalidate_orders([instance.pk], [instance.user_id])
+        if new_status == Order.STATUS_SHIPPED:
+            # задачу ставим после коммита UPDATE — воркер должен прочитать уже новый статус
+            transaction.on_commit(partial(tasks.order_shipped_notify_external.delay, instance.id))
         return instance
@@ -1,54 +1,146 @@
+import threading
+import weakref
+
 from django.core.cache import cache
-from django.db.models.signals import post_save, post_delete
+from django.db import transaction
+from django.db.models import Count, Exists, OuterRef, Subquery
+from django.db.models.signals import post_migrate, post_save, post_delete
 from django.dispatch import receiver
 
 from apps.orders.models import Order, OrderItem
+from online_store.cache_utils import incr_version
+
+
+# шаблоны ключей кэша — связанные .format, собранные один раз при импорте
+_USER_LIST_VERSION_KEY = "orders:user:{}:list:version".format
+order_detail_key = "order:{}".format
 
 
-def _incr_version(key: str, initial: int = 1) -> None:
-    """Атомарно инкрементируем версию кэш-списков (fallback для backends без incr)."""
-    cache.add(key, initial)
-    try:
-        cache.incr(key)
-    except Exception:
-        current = cache.get(key) or initial
-        cache.set(key, int(current) + 1)
+def user_list_version_key(user_id) -> str:
+    """Версия списков заказов конкретного пользователя: bump не сбрасывает кэш остальных."""
+    return _USER_LIST_VERSION_KEY(user_id)
 
 
-def _bump_user_admin_lists(order: Order):
-    """Поднять версии пользовательских и админских списков после изменений заказа/состава."""
-    # список конкретного пользователя (учитывается в ключе OrderListCreateView)
-    _incr_version("orders:user:list:version")
+def _bump_lists(user_ids: set) -> None:
+    # списки затронутых пользователей (учитываются в ключе OrderListCreateView)
+    for user_id in user_ids:
+        incr_version(user_list_version_key(user_id))
     # общий админский список (AdminOrderListView)
-    _incr_version("orders:admin:list:version")
+    incr_version("orders:admin:list:version")
+
+
+class _PendingBumps:
+    """
+    Отложенный до коммита bump списков одной транзакции: user_ids копятся в множестве,
+    в transaction.on_commit регистрируется один этот объект.
+    """
+
+    def __init__(self):
+        self.user_ids: set = set()
+        self.done = False
+
+    def __call__(self):
+        self.done = True
+        _bump_lists(self.user_ids)
+
+
+# текущий отложенный bump по алиасу соединения (соединения у Django — свои в каждом потоке).
+# Храним weakref: при откате транзакции/savepoint Django выбрасывает колбэк из очереди on_commit,
+# объект собирается вместе с накопленными user_ids — следующий сигнал заведёт новый.
+_PENDING_BUMPS = threading.local()
+
+
+def _bump_user_admin_lists(user_ids) -> None:
+    """
+    Поднять версии списков пользователей user_ids и админского списка после изменений заказа/состава.
+    Bump откладываем до коммита и ставим один раз на транзакцию: сохранение заказа с N позициями
+    в одном atomic-блоке (инлайн админки) даёт один bump вместо N — новые user_ids дописываются
+    в уже отложенный _PendingBumps. Вне транзакции on_commit выполняет bump сразу.
+    """
+    alias = transaction.get_connection().alias
+    ref = getattr(_PENDING_BUMPS, alias, None)
+    pending = ref() if ref is not None else None
+    if pending is not None and not pending.done:
+        pending.user_ids.update(user_ids)
+        return
+    pending = _PendingBumps()
+    pending.user_ids.update(user_ids)
+    setattr(_PENDING_BUMPS, alias, weakref.ref(pending))
+    transaction.on_commit(pending)
+
+
+def _skip(instance, kwargs) -> bool:
+    """
+    Сигнальную инвалидацию пропускаем для загрузки фикстур (raw) и для инстансов из bulk-путей,
+    которые сами инвалидируют кэш явно (выставляют _skip_cache_signal) — см. OrderCreateSerializer.create.
+    """
+    return kwargs.get("raw", False) or getattr(instance, "_skip_cache_signal", False)
+
+
+def invalidate_order_lists(user_id) -> None:
+    """Только bump списков — для новых заказов, детали которых в кэше ещё нет."""
+    _bump_user_admin_lists([user_id])
+
+
+def invalidate_orders(pks, user_ids) -> None:
+    """
+    Инвалидация для bulk-путей (QuerySet.update() не шлёт post_save):
+    детали заказов одним delete_many и один bump списков владельцев и админского списка.
+    """
+    cache.delete_many([order_detail_key(pk) for pk in pks])
+    _bump_user_admin_lists(user_ids)
 
 
 # -------- Order: инвалидация --------
 
 @receiver(post_save, sender=Order, dispatch_uid="order_saved_cache_invalidation")
 def order_saved(sender, instance: Order, **kwargs):
+    if _skip(instance, kwargs):
+        return
     # чистим деталь
-    cache.delete(f"order:{instance.pk}")
+    cache.delete(order_detail_key(instance.pk))
     # bump списков
-    _bump_user_admin_lists(instance)
+    _bump_user_admin_lists([instance.user_id])
 
 
 @receiver(post_delete, sender=Order, dispatch_uid="order_deleted_cache_invalidation")
 def order_deleted(sender, instance: Order, **kwargs):
-    cache.delete(f"order:{instance.pk}")
-    _bump_user_admin_lists(instance)
+    cache.delete(order_detail_key(instance.pk))
+    _bump_user_admin_lists([instance.user_id])
 
 
 # -------- OrderItem: инвалидация --------
 
 @receiver(post_save, sender=OrderItem, dispatch_uid="orderitem_saved_cache_invalidation")
 def orderitem_saved(sender, instance: OrderItem, **kwargs):
+    if _skip(instance, kwargs):
+        return
     # изменение состава влияет на деталь заказа + списки
-    cache.delete(f"order:{instance.order_id}")
-    _bump_user_admin_lists(instance.order)
+    cache.delete(order_detail_key(instance.order_id))
+    _bump_user_admin_lists([instance.order.user_id])
 
 
 @receiver(post_delete, sender=OrderItem, dispatch_uid="orderitem_deleted_cache_invalidation")
 def orderitem_deleted(sender, instance: OrderItem, **kwargs):
-    cache.delete(f"order:{instance.order_id}")
-    _bump_user_admin_lists(instance.order)
+    cache.delete(order_detail_key(instance.order_id))
+    _bump_user_admin_lists([instance.order.user_id])
+
+
+# -------- backfill денормализованных полей --------
+
+@receiver(post_migrate, dispatch_uid="order_items_count_backfill")
+def backfill_order_items_count(sender, using=None, **kwargs):
+    """Заполняем Order.items_count у заказов, созданных до появления колонки (миграции — при старте)."""
+    if sender.name != "apps.orders":
+        return
+    has_items = OrderItem.objects.filter(order=OuterRef("pk"))
+    items_count = (
+        OrderItem.objects.filter(order=OuterRef("pk"))
+        .order_by()
+        .values("order")
+        .annotate(c=Count("pk"))
+        .values("c")
+    )
+    Order.objects.using(using).filter(items_count=0).filter(Exists(has_items)).update(
+        items_count=Subquery(items_count)
+    )
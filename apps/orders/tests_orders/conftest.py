@@ -3,13 +3,19 @@ from django.core.cache import cache
 from rest_framework.test import APIClient
 
 from apps.catalog.models import Category, Product
+from apps.orders import views as orders_views
+from online_store import cache_utils
 
 
 @pytest.fixture(autouse=True)
 def _clear_cache():
     cache.clear()
+    cache_utils._LOCAL_VERSIONS.clear()
+    orders_views._LIST_L1.clear()
     yield
     cache.clear()
+    cache_utils._LOCAL_VERSIONS.clear()
+    orders_views._LIST_L1.clear()
 
 
 @pytest.fixture
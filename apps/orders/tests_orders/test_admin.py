@@ -0,0 +1,83 @@
+import pytest
+from django.contrib import admin, messages
+from django.core.cache import cache
+
+from apps.orders.admin import OrderAdmin
+from apps.orders.models import Order
+from apps.orders.signals import order_detail_key
+
+
+@pytest.fixture
+def order_admin(monkeypatch):
+    """OrderAdmin, у которого сообщения пользователю копятся в списке (без session/messages middleware)."""
+    model_admin = OrderAdmin(Order, admin.site)
+    model_admin.sent_messages = []
+    monkeypatch.setattr(
+        model_admin, "message_user",
+        lambda request, message, level=messages.INFO, **kw: model_admin.sent_messages.append((level, message)),
+    )
+    return model_admin
+
+
+@pytest.mark.django_db
+def test_bulk_status_updates_allowed_and_reports_rejected(order_admin, rf, admin_user, user, django_capture_on_commit_callbacks):
+    pending = Order.objects.create(user=user)
+    processing = Order.objects.create(user=user, status=Order.STATUS_PROCESSING)
+    delivered = Order.objects.create(user=user, status=Order.STATUS_DELIVERED)
+    cancelled = Order.objects.create(user=user, status=Order.STATUS_CANCELLED)
+    cache.set(order_detail_key(pending.pk), ({"id": pending.pk}, 0))
+
+    request = rf.post("/admin/orders/order/")
+    request.user = admin_user
+    with django_capture_on_commit_callbacks(execute=True):
+        order_admin.mark_cancelled(request, Order.objects.filter(pk__in=[pending.pk, processing.pk, delivered.pk, cancelled.pk]))
+
+    # pending/processing → cancelled одним UPDATE; delivered (финальный) не тронут
+    statuses = dict(Order.objects.values_list("pk", "status"))
+    assert statuses == {
+        pending.pk: Order.STATUS_CANCELLED,
+        processing.pk: Order.STATUS_CANCELLED,
+        delivered.pk: Order.STATUS_DELIVERED,
+        cancelled.pk: Order.STATUS_CANCELLED,
+    }
+    # .update() без post_save — деталь из кэша всё равно сброшена
+    assert cache.get(order_detail_key(pending.pk)) is None
+
+    levels = [level for level, _ in order_admin.sent_messages]
+    assert levels.count(messages.SUCCESS) == 1
+    assert any(f"#{delivered.pk}" in msg for level, msg in order_admin.sent_messages if level == messages.WARNING)
+    assert any(msg.endswith("успешно — 2") for _, msg in order_admin.sent_messages)
+    # заказ, уже бывший в целевом статусе, не считается ни успешным, ни отклонённым
+    assert any(msg.endswith("уже в статусе cancelled — 1") for _, msg in order_admin.sent_messages)
+
+
+@pytest.mark.django_db
+def test_bulk_status_guard_skips_concurrently_changed_orders(
+    order_admin, rf, admin_user, user, django_capture_on_commit_callbacks
+):
+    order = Order.objects.create(user=user)
+    cache.set(order_detail_key(order.pk), ({"id": order.pk}, 0))
+    request = rf.post("/admin/orders/order/")
+    request.user = admin_user
+
+    # статус сменили между выборкой (values_list) и UPDATE — guard по старому статусу не даёт перезаписать
+    queryset = Order.objects.filter(pk=order.pk)
+    real_values_list = type(queryset).values_list
+
+    def values_list_then_cancel(self, *fields, **kwargs):
+        rows = list(real_values_list(self, *fields, **kwargs))
+        if fields == ("pk", "user_id"):
+            Order.objects.filter(pk=order.pk).update(status=Order.STATUS_CANCELLED)
+        return rows
+
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(type(queryset), "values_list", values_list_then_cancel)
+        with django_capture_on_commit_callbacks(execute=True) as callbacks:
+            order_admin.mark_processing(request, queryset)
+
+    order.refresh_from_db()
+    assert order.status == Order.STATUS_CANCELLED
+    assert not any(level == messages.SUCCESS for level, _ in order_admin.sent_messages)
+    # ничего не перевели — и инвалидировать нечего: деталь в кэше, bump списков не ставили
+    assert cache.get(order_detail_key(order.pk)) is not None
+    assert callbacks == []
@@ -5,7 +5,7 @@ from apps.orders.models import Order, OrderItem
 
 
 @pytest.mark.django_db
-def test_create_order_success_and_celery_called(api_client, products, monkeypatch):
+def test_create_order_success_and_celery_called(api_client, products, monkeypatch, django_capture_on_commit_callbacks):
     p1, p2 = products
 
     # замокаем Celery-задачи (delay)
@@ -30,8 +30,9 @@ def test_create_order_success_and_celery_called(api_client, products, monkeypatc
         ]
     }
 
-    # создание
-    r = api_client.post(url, payload, format="json")
+    # создание (задачи ставятся в on_commit — выполняем колбэки явно)
+    with django_capture_on_commit_callbacks(execute=True):
+        r = api_client.post(url, payload, format="json")
     assert r.status_code == 201, r.json()
     data = r.json()
     order_id = data["id"]
@@ -50,6 +51,7 @@ def test_create_order_success_and_celery_called(api_client, products, monkeypatc
     r1 = api_client.get(list_url)
     assert r1.status_code == 200
     assert r1["X-Cache"] == "MISS"
+    assert r1.json()[0]["items_count"] == 2  # p1 и p2 после агрегации дубликатов
 
     r2 = api_client.get(list_url)
     assert r2.status_code == 200
@@ -88,13 +90,18 @@ def test_permissions_only_owner_can_view_order(api_client, other_client, product
     assert create.status_code == 201
     order_id = create.json()["id"]
 
-    # другой пользователь не может видеть — 403
+    # другой пользователь не может видеть — 404 (существование чужого заказа не раскрываем)
+    resp = other_client.get(reverse("orders-detail", kwargs={"pk": order_id}))
+    assert resp.status_code == 404
+
+    # в том числе когда деталь уже лежит в кэше после просмотра владельцем
+    assert api_client.get(reverse("orders-detail", kwargs={"pk": order_id})).status_code == 200
     resp = other_client.get(reverse("orders-detail", kwargs={"pk": order_id}))
-    assert resp.status_code == 403
+    assert resp.status_code == 404
 
 
 @pytest.mark.django_db
-def test_status_transitions_and_shipped_task(api_client, products, monkeypatch):
+def test_status_transitions_and_shipped_task(api_client, products, monkeypatch, django_capture_on_commit_callbacks):
     p1, _ = products
 
     # замокаем shipped-задачу
@@ -113,7 +120,8 @@ def test_status_transitions_and_shipped_task(api_client, products, monkeypatch):
     assert patch1.json()["status"] == "processing"
 
     # processing -> shipped (должна дёрнуться задача)
-    patch2 = api_client.patch(reverse("orders-detail", kwargs={"pk": order_id}), {"status": "shipped"}, format="json")
+    with django_capture_on_commit_callbacks(execute=True):
+        patch2 = api_client.patch(reverse("orders-detail", kwargs={"pk": order_id}), {"status": "shipped"}, format="json")
     assert patch2.status_code == 200
     assert patch2.json()["status"] == "shipped"
     assert shipped_called["order"] == order_id
@@ -142,3 +150,166 @@ def test_admin_orders_list_filters(admin_client, api_client, products):
     q2 = admin_client.get(url, {"status": "pending"})
     assert q2.status_code == 200
     assert q2["X-Cache"] == "HIT"
+
+
+@pytest.mark.django_db
+def test_user_orders_list_ignores_paging_params_and_orders(api_client, products):
+    p1, p2 = products
+    cheap = api_client.post(reverse("orders-list"), {"items": [{"product_id": p2.id, "quantity": 1}]}, format="json")
+    pricey = api_client.post(reverse("orders-list"), {"items": [{"product_id": p1.id, "quantity": 1}]}, format="json")
+    assert cheap.status_code == pricey.status_code == 201
+
+    url = reverse("orders-list")
+    # пагинации у списка нет: page/page_size не обрезают ответ
+    r = api_client.get(url, {"page": 2, "page_size": 1})
+    assert r.status_code == 200
+    assert len(r.json()) == 2
+
+    # сортировка по разрешённому полю; неизвестное поле игнорируется (порядок по умолчанию)
+    r_price = api_client.get(url, {"ordering": "total_price"})
+    assert [o["id"] for o in r_price.json()] == [cheap.json()["id"], pricey.json()["id"]]
+    r_bad = api_client.get(url, {"ordering": "user__password"})
+    assert r_bad.status_code == 200
+    assert len(r_bad.json()) == 2
+
+
+@pytest.mark.django_db
+def test_status_patch_concurrent_change_returns_400(api_client, user, monkeypatch):
+    from apps.orders.views import OrderDetailView
+
+    order = Order.objects.create(user=user)
+    real_get_object = OrderDetailView.get_object
+
+    def get_object_then_cancel(self):
+        # заказ уже загружен (pending), а параллельный запрос успел его отменить
+        obj = real_get_object(self)
+        Order.objects.filter(pk=obj.pk).update(status=Order.STATUS_CANCELLED)
+        return obj
+
+    monkeypatch.setattr(OrderDetailView, "get_object", get_object_then_cancel)
+    r = api_client.patch(reverse("orders-detail", kwargs={"pk": order.id}), {"status": "processing"}, format="json")
+
+    # guard по старому статусу в UPDATE: 0 строк → 400, отменённый заказ не перезаписан
+    assert r.status_code == 400
+    assert "status" in r.json()
+    order.refresh_from_db()
+    assert order.status == Order.STATUS_CANCELLED
+
+
+@pytest.mark.django_db
+def test_order_change_bumps_only_owner_list_version(
+    api_client, other_client, user, other_user, products, monkeypatch, django_capture_on_commit_callbacks
+):
+    from django.core.cache import cache
+
+    import apps.orders.tasks as tasks
+    from apps.orders.signals import user_list_version_key
+
+    # on_commit выполняем явно — задачу создания заказа мокаем, брокер не нужен
+    monkeypatch.setattr(tasks.order_created_generate_pdf_and_email, "delay", lambda order_id: None)
+
+    p1, _ = products
+    url = reverse("orders-list")
+    assert api_client.get(url)["X-Cache"] == "MISS"
+    assert other_client.get(url)["X-Cache"] == "MISS"
+    other_version = cache.get(user_list_version_key(other_user.id))
+
+    # заказ user: bump только его версии списков (и админской), список other_user остаётся в кэше
+    with django_capture_on_commit_callbacks(execute=True):
+        assert api_client.post(url, {"items": [{"product_id": p1.id, "quantity": 1}]}, format="json").status_code == 201
+
+    assert cache.get(user_list_version_key(other_user.id)) == other_version
+    mine = api_client.get(url)
+    assert mine["X-Cache"] == "MISS"
+    assert len(mine.json()) == 1
+    theirs = other_client.get(url)
+    assert theirs["X-Cache"] == "HIT"
+    assert theirs.json() == []
+
+
+@pytest.mark.django_db
+def test_user_orders_list_serves_stale_while_another_request_revalidates(api_client, user):
+    from django.core.cache import cache
+
+    from apps.orders import views as orders_views
+
+    Order.objects.create(user=user)
+    url = reverse("orders-list")
+    assert api_client.get(url)["X-Cache"] == "MISS"
+
+    # запись протухла по soft_deadline; L1 пуст (другой процесс)
+    cache_key = orders_views._USER_LIST_KEY(u=user.id, v=1, h=orders_views._DEFAULT_PARAMS_SUFFIX)
+    data, _ = cache.get(cache_key)
+    cache.set(cache_key, (data, 0))
+    orders_views._LIST_L1.clear()
+
+    # пересчёт уже идёт (lock занят) — отдаём устаревшие данные, а не идём в БД
+    cache.add(f"{cache_key}:lock", 1)
+    stale = api_client.get(url)
+    assert stale["X-Cache"] == "STALE"
+    assert len(stale.json()) == 1
+
+    # lock свободен — этот запрос берёт его и пересчитывает, следующий снова HIT
+    cache.delete(f"{cache_key}:lock")
+    orders_views._LIST_L1.clear()
+    assert api_client.get(url)["X-Cache"] == "MISS"
+    assert api_client.get(url)["X-Cache"] == "HIT"
+
+
+@pytest.mark.django_db
+def test_user_orders_list_l1_hit_skips_memcached(api_client, user, monkeypatch, no_cache_reads):
+    from apps.orders import views as orders_views
+
+    Order.objects.create(user=user)
+    url = reverse("orders-list")
+    assert api_client.get(url)["X-Cache"] == "MISS"
+
+    # версия свежая в процессе, ответ в L1: повторный запрос не читает Memcached вовсе
+    monkeypatch.setattr(orders_views, "cache", no_cache_reads)
+    r = api_client.get(url)
+    assert r["X-Cache"] == "HIT"
+    assert len(r.json()) == 1
+
+
+@pytest.mark.django_db
+def test_order_detail_non_owner_does_not_take_swr_lock(api_client, other_client, user):
+    from django.core.cache import cache
+
+    from apps.orders.signals import order_detail_key
+
+    order = Order.objects.create(user=user)
+    url = reverse("orders-detail", kwargs={"pk": order.id})
+    assert api_client.get(url)["X-Cache"] == "MISS"
+
+    # запись протухла: чужой запрос получает 404 и не занимает lock пересчёта
+    data, _ = cache.get(order_detail_key(order.id))
+    cache.set(order_detail_key(order.id), (data, 0))
+    assert other_client.get(url).status_code == 404
+    assert cache.get(f"{order_detail_key(order.id)}:lock") is None
+
+    # владелец сам берёт lock и пересчитывает, а не получает STALE
+    assert api_client.get(url)["X-Cache"] == "MISS"
+
+
+class _FreshVersionCache:
+    """Кэш без версий: incr падает (ключа нет), add запоминает timeout."""
+
+    def __init__(self):
+        self.add_timeouts = {}
+
+    def incr(self, key):
+        raise ValueError(key)
+
+    def add(self, key, value, timeout=300):
+        self.add_timeouts[key] = timeout
+        return True
+
+
+def test_list_version_key_is_created_without_expiry(monkeypatch):
+    from online_store import cache_utils
+
+    # incr срок жизни не продлевает: ключ версии с TTL истёк бы раньше SWR-записей и вернул старые ключи
+    fake = _FreshVersionCache()
+    monkeypatch.setattr(cache_utils, "cache", fake)
+    cache_utils.incr_version("orders:admin:list:version")
+    assert fake.add_timeouts == {"orders:admin:list:version": None}
@@ -0,0 +1,29 @@
+import pytest
+from django.db import transaction
+
+from apps.orders import signals as orders_signals
+
+
+@pytest.mark.django_db
+def test_list_bumps_deduplicated_per_transaction(django_capture_on_commit_callbacks):
+    with django_capture_on_commit_callbacks() as callbacks:
+        orders_signals._bump_user_admin_lists([1])
+        orders_signals._bump_user_admin_lists([2, 1])
+
+    # один отложенный bump на транзакцию со всеми затронутыми пользователями
+    assert len(callbacks) == 1
+    assert callbacks[0].user_ids == {1, 2}
+
+
+@pytest.mark.django_db
+def test_rolled_back_list_bump_is_dropped(django_capture_on_commit_callbacks):
+    with django_capture_on_commit_callbacks() as callbacks:
+        with pytest.raises(RuntimeError):
+            with transaction.atomic():
+                orders_signals._bump_user_admin_lists([1])
+                raise RuntimeError
+        # откат savepoint выбросил отложенный bump — следующий сигнал заводит новый, без user_ids отката
+        orders_signals._bump_user_admin_lists([2])
+
+    assert len(callbacks) == 1
+    assert callbacks[0].user_ids == {2}
@@ -0,0 +1,109 @@
+import pytest
+import requests
+
+import apps.orders.tasks as tasks
+from apps.orders.models import Order, OrderItem
+
+
+@pytest.fixture
+def order(user, products):
+    p1, _ = products
+    o = Order.objects.create(user=user)
+    OrderItem.objects.create(order=o, product=p1, quantity=2, price_at_purchase=p1.price)
+    return o
+
+
+@pytest.mark.django_db
+def test_pdf_generation_is_atomic(order, settings, tmp_path, monkeypatch):
+    settings.MEDIA_ROOT = str(tmp_path)
+
+    path = tasks.order_created_generate_pdf_and_email(order.id)
+    pdf_dir = tmp_path / "order_receipts"
+    good = (pdf_dir / f"order_{order.id}.pdf").read_bytes()
+    assert path.endswith(f"order_{order.id}.pdf")
+    assert good.startswith(b"%PDF")
+
+    # падение посреди записи: прежний PDF цел, временных файлов не остаётся
+    def broken_save(self):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(tasks.canvas.Canvas, "save", broken_save)
+    with pytest.raises(OSError):
+        tasks.order_created_generate_pdf_and_email(order.id)
+    assert (pdf_dir / f"order_{order.id}.pdf").read_bytes() == good
+    assert [p.name for p in pdf_dir.iterdir()] == [f"order_{order.id}.pdf"]
+
+
+def test_shipped_notify_batch_requeues_failed_ids(monkeypatch):
+    posted, requeued = [], []
+
+    def fake_notify(order_id):
+        if order_id == 2:
+            raise requests.ConnectionError("boom")
+        posted.append(order_id)
+        return {"id": order_id}
+
+    monkeypatch.setattr(tasks, "_notify_shipped", fake_notify)
+    monkeypatch.setattr(tasks.order_shipped_notify_external, "delay", requeued.append)
+
+    # упавший заказ не рвёт пачку и уходит в одиночную задачу с её ретраями; отправленные повторно не шлём
+    assert tasks.order_shipped_notify_batch([1, 2, 3]) == 2
+    assert posted == [1, 3]
+    assert requeued == [2]
+
+
+@pytest.mark.django_db
+def test_admin_mark_shipped_enqueues_one_batch_after_commit(rf, admin_user, user, monkeypatch, django_capture_on_commit_callbacks):
+    from django.contrib import admin
+
+    from apps.orders.admin import OrderAdmin
+
+    o1 = Order.objects.create(user=user, status=Order.STATUS_PROCESSING)
+    o2 = Order.objects.create(user=user, status=Order.STATUS_PROCESSING)
+    batches, single = [], []
+    monkeypatch.setattr(tasks.order_shipped_notify_batch, "delay", batches.append)
+    monkeypatch.setattr(tasks.order_shipped_notify_external, "delay", single.append)
+
+    model_admin = OrderAdmin(Order, admin.site)
+    monkeypatch.setattr(model_admin, "message_user", lambda *a, **kw: None)
+    request = rf.post("/admin/orders/order/")
+    request.user = admin_user
+    with django_capture_on_commit_callbacks(execute=True):
+        model_admin.mark_shipped(request, Order.objects.filter(pk__in=[o1.pk, o2.pk]))
+
+    # одно сообщение в брокер на всю пачку, без задачи на каждый заказ
+    assert [sorted(b) for b in batches] == [sorted([o1.pk, o2.pk])]
+    assert single == []
+
+
+@pytest.mark.django_db
+def test_admin_mark_shipped_notifies_only_transitioned_orders(rf, admin_user, user, monkeypatch, django_capture_on_commit_callbacks):
+    from django.contrib import admin
+
+    from apps.orders.admin import OrderAdmin
+
+    shipped = Order.objects.create(user=user, status=Order.STATUS_PROCESSING)
+    raced = Order.objects.create(user=user, status=Order.STATUS_PROCESSING)
+    batches = []
+    monkeypatch.setattr(tasks.order_shipped_notify_batch, "delay", batches.append)
+
+    model_admin = OrderAdmin(Order, admin.site)
+    monkeypatch.setattr(model_admin, "message_user", lambda *a, **kw: None)
+    request = rf.post("/admin/orders/order/")
+    request.user = admin_user
+
+    # один заказ отменили между выборкой и UPDATE — уведомление об отправке ему не уходит
+    queryset = Order.objects.filter(pk__in=[shipped.pk, raced.pk])
+    real_values_list = type(queryset).values_list
+
+    def values_list_then_cancel(self, *fields, **kwargs):
+        rows = list(real_values_list(self, *fields, **kwargs))
+        if fields == ("pk", "user_id"):
+            Order.objects.filter(pk=raced.pk).update(status=Order.STATUS_CANCELLED)
+        return rows
+
+    monkeypatch.setattr(type(queryset), "values_list", values_list_then_cancel)
+    with django_capture_on_commit_callbacks(execute=True):
+        model_admin.mark_shipped(request, queryset)
+
+    assert batches == [[shipped.pk]]
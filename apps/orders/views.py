@@ -1,97 +1,195 @@
 import hashlib
 import random
-from urllib.parse import urlencode
+import time
+from datetime import datetime, timedelta
 
 from django.core.cache import cache
+from django.db.models import Prefetch
 from django.shortcuts import get_object_or_404
-from rest_framework import generics, permissions, filters, status
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from rest_framework import generics, permissions, status
 from rest_framework.response import Response
+from rest_framework.views import APIView
 
-from apps.orders.models import Order
+from apps.orders.models import Order, OrderItem
 from apps.orders.serializers import (
+    ORDER_LIST_FIELDS,
     OrderCreateSerializer,
     OrderListSerializer,
     OrderDetailSerializer,
     OrderStatusPatchSerializer,
     PlainBadRequest
 )
+from apps.orders.signals import order_detail_key, user_list_version_key
+from online_store.cache_utils import LocalCache, local_list_version, remember_list_version
 
 
 # ---------- cache utils ----------
 
 def _ttl_with_jitter(base: int = 60, jitter: float = 0.10) -> int:
+    """TTL ±jitter от базового значения; randrange — без лишней обёртки randint."""
     delta = int(base * jitter)
-    return base + random.randint(-delta, delta)
+    return base + random.randrange(-delta, delta + 1)
 
 
 def _hash_params(params: dict) -> str:
-    encoded = urlencode(sorted(params.items()), doseq=True)
-    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+    """
+    Короткий blake2b-хэш параметров для ключа кэша: не граница безопасности, 64 бит хватает.
+    Без urlencode/quote: длина значения в префиксе делает конкатенацию однозначной.
+    """
+    h = hashlib.blake2b(digest_size=8)
+    for k in sorted(params):
+        raw = str(params[k]).encode("utf-8")
+        h.update(f"{k}:{len(raw)}:".encode("utf-8"))
+        h.update(raw)
+    return h.hexdigest()
+
+
+# L1: in-process кэш последних ответов списков перед Memcached (повторные запросы/поллинг).
+# Ключ — тот же cache_key (в нём версия, пользователь и параметры); явной инвалидации нет —
+# bump версии меняет ключ, а короткий TTL ограничивает устаревание данных из других процессов.
+_LIST_L1 = LocalCache(max_size=1024, ttl=2.0)
+
+
+def _get_versioned(version_key: str, key_for) -> tuple[int, str, object]:
+    """
+    Версия списков + payload. Пока известная процессу версия свежая (см. cache_utils.LOCAL_VERSION_TTL),
+    версию из кэша не читаем вовсе: сначала L1, затем один get. Иначе один get_many: ключ строим
+    по последней известной версии; если версия в кэше другая — делаем ещё один get по актуальному ключу.
+    Найденное в Memcached кладём и в L1. Возвращает (version, cache_key, cached | None).
+    """
+    guess, fresh = local_list_version(version_key)
+    if fresh:
+        cache_key = key_for(guess)
+        cached = _LIST_L1.get(cache_key)
+        if cached is None:
+            cached = cache.get(cache_key)
+            if cached is not None:
+                _LIST_L1.set(cache_key, cached)
+        return guess, cache_key, cached
+
+    guess = guess or 1
+    candidate = key_for(guess)
+    got = cache.get_many([version_key, candidate])
+    v = got.get(version_key)
+    version = v if isinstance(v, int) and v > 0 else 1
+    remember_list_version(version_key, version)
+    if version == guess:
+        cache_key, cached = candidate, got.get(candidate)
+    else:
+        cache_key = key_for(version)
+        cached = cache.get(cache_key)
+    if cached is not None:
+        _LIST_L1.set(cache_key, cached)
+    return version, cache_key, cached
+
+
+# шаблоны ключей списков — связанные .format, собранные один раз при импорте (деталь — signals.order_detail_key)
+_USER_LIST_KEY = "orders:list:user:{u}:v{v}:{h}".format
+_ADMIN_LIST_KEY = "admin:orders:list:v{v}:{h}".format
+
+# суффикс ключа для запроса без query-параметров (самый частый вариант): без сборки params и хэширования
+_DEFAULT_PARAMS_SUFFIX = "default"
+
+
+def _ordering_param(request, default: str) -> str:
+    """?ordering=... для ключа кэша; без параметра — заранее посчитанное значение по умолчанию."""
+    ordering = request.query_params.getlist("ordering")
+    return ",".join(ordering) if ordering else default
+
+
+def _day_start(value: str | None) -> datetime | None:
+    """Начало дня YYYY-MM-DD в текущей таймзоне (как у lookup-а __date) или None для пустых/некорректных дат."""
+    try:
+        day = parse_date(value or "")
+    except ValueError:
+        return None
+    if day is None:
+        return None
+    return timezone.make_aware(datetime.combine(day, datetime.min.time()))
+
+
+# stale-while-revalidate: в кэше (data, soft_deadline) с длинным жёстким TTL.
+# До soft_deadline отдаём как HIT; после — пересчитывает один запрос (взявший lock через cache.add),
+# остальные в это время получают устаревшие данные (STALE), а не идут в БД все разом.
+_SWR_HARD_TTL = 600
+_SWR_LOCK_TTL = 10
 
 
-def _orders_user_list_version() -> int:
-    v = cache.get("orders:user:list:version")
-    return v if isinstance(v, int) and v > 0 else 1
+def _swr_read(cache_key: str, cached) -> tuple[object, str]:
+    """
+    (data, X-Cache) для отдачи из кэша или (None, "MISS"), если пересчитывать должен этот запрос.
+    """
+    if not isinstance(cached, tuple):
+        return None, "MISS"  # промах (или запись старого формата без soft_deadline)
+    data, soft_deadline = cached
+    if time.time() < soft_deadline:
+        return data, "HIT"
+    if cache.add(f"{cache_key}:lock", 1, timeout=_SWR_LOCK_TTL):
+        return None, "MISS"
+    return data, "STALE"
 
 
-def _orders_admin_list_version() -> int:
-    v = cache.get("orders:admin:list:version")
-    return v if isinstance(v, int) and v > 0 else 1
+def _swr_set(cache_key: str, data, soft: int = 60) -> tuple:
+    """
+    Сохранить data: свежесть — soft с джиттером, храним до _SWR_HARD_TTL для отдачи устаревшего.
+    Возвращает сохранённую запись (для L1 списков).
+    """
+    entry = (data, time.time() + _ttl_with_jitter(soft))
+    cache.set(cache_key, entry, timeout=_SWR_HARD_TTL)
+    return entry
 
 
-# ---------- permissions ----------
+# ---------- ordering ----------
+# списки — простые APIView: сортировку считаем сами, без filter_backends DRF (на HIT она не нужна вовсе).
+# Пагинации у списков нет (как и раньше, pagination_class не настроен) — отдаём весь список.
 
-class IsOwnerOrAdmin(permissions.BasePermission):
-    def has_object_permission(self, request, view, obj: Order):
-        return request.user.is_staff or obj.user_id == request.user.id
+def _ordering(request, allowed: frozenset, default: tuple) -> tuple:
+    """?ordering=a,-b → поля из allowed (неизвестные отбрасываем, как OrderingFilter); иначе default."""
+    terms = (t.strip() for value in request.query_params.getlist("ordering") for t in value.split(","))
+    valid = tuple(t for t in terms if t.lstrip("-") in allowed)
+    return valid or default
 
 
 # ---------- user endpoints ----------
 
-class OrderListCreateView(generics.GenericAPIView):
+class OrderListCreateView(APIView):
     """
     GET /api/v1/orders/         — список заказов текущего пользователя (кэш 60с)
     POST /api/v1/orders/        — создание заказа (см. OrderCreateSerializer)
     """
     permission_classes = [permissions.IsAuthenticated]
-    filter_backends = [filters.OrderingFilter]
-    ordering_fields = ["created_at", "total_price", "status"]
-    ordering = ["-created_at"]
+    ordering_fields = frozenset({"created_at", "total_price", "status"})
+    ordering = ("-created_at",)
+    # значение ordering в ключе кэша по умолчанию — считаем один раз при загрузке класса
+    _default_ordering_param = ",".join(ordering)
 
     def get_queryset(self):
-        return (
-            Order.objects.filter(user=self.request.user)
-            .only("id", "status", "total_price", "created_at", "updated_at", "user_id")
-            .order_by(*self.ordering)
-        )
+        return Order.objects.filter(user=self.request.user).values(*ORDER_LIST_FIELDS)
 
     def get(self, request, *args, **kwargs):
-        """кэш ключ с версией + user + ordering/pagination"""
-        params = {
-            "ordering": ",".join(request.query_params.getlist("ordering")) or "-created_at",
-            "page": request.query_params.get("page", ""),
-            "page_size": request.query_params.get("page_size", ""),
-        }
-        version = _orders_user_list_version()
-        cache_key = f"orders:list:user:{request.user.id}:v{version}:{_hash_params(params)}"
-
-        cached = cache.get(cache_key)
-        if cached is not None:
-            resp = Response(cached)
-            resp["X-Cache"] = "HIT"
-            return resp
-
-        qs = self.filter_queryset(self.get_queryset())
-        page = self.paginate_queryset(qs)
-        if page is not None:
-            data = OrderListSerializer(page, many=True).data
-            cache.set(cache_key, data, timeout=_ttl_with_jitter())
-            resp = self.get_paginated_response(data)
-            resp["X-Cache"] = "MISS"
+        """кэш ключ с версией + user + ordering"""
+        if request.query_params:
+            params = {
+                "ordering": _ordering_param(request, self._default_ordering_param),
+            }
+            params_hash = _hash_params(params)
+        else:
+            params_hash = _DEFAULT_PARAMS_SUFFIX
+        _, cache_key, cached = _get_versioned(
+            user_list_version_key(request.user.id),
+            lambda v: _USER_LIST_KEY(u=request.user.id, v=v, h=params_hash),
+        )
+        data, cache_status = _swr_read(cache_key, cached)
+        if data is not None:
+            resp = Response(data)
+            resp["X-Cache"] = cache_status
             return resp
 
+        qs = self.get_queryset().order_by(*_ordering(request, self.ordering_fields, self.ordering))
         data = OrderListSerializer(qs, many=True).data
-        cache.set(cache_key, data, timeout=_ttl_with_jitter())
+        _LIST_L1.set(cache_key, _swr_set(cache_key, data))
         resp = Response(data)
         resp["X-Cache"] = "MISS"
         return resp
@@ -105,7 +203,7 @@ class OrderListCreateView(generics.GenericAPIView):
             return Response(e.payload, status=status.HTTP_400_BAD_REQUEST)
         # деталь в ответе
         data = OrderDetailSerializer(order).data
-        # инвалидация списка пользователя (версия поднимет сигнал — см. orders/signals.py)
+        # инвалидация списков — bump версий после коммита (см. OrderCreateSerializer.create)
         return Response(data, status=status.HTTP_201_CREATED)
 
 
@@ -113,26 +211,37 @@ class OrderDetailView(generics.GenericAPIView):
     """
     GET    /api/v1/orders/{id}/    — детальная информация (владелец/админ, кэш 60с)
     PATCH  /api/v1/orders/{id}/    — обновление статуса (владелец ограниченно/админ)
+    Чужой заказ для не-админа — 404 (фильтр по владельцу прямо в запросе), без раскрытия существования.
     """
-    permission_classes = [permissions.IsAuthenticated, IsOwnerOrAdmin]
+    permission_classes = [permissions.IsAuthenticated]
 
     def get_object(self):
-        order = get_object_or_404(Order.objects.select_related("user"), pk=self.kwargs["pk"])
-        self.check_object_permissions(self.request, order)
-        return order
+        # позиции с продуктами — одним prefetch, без запроса на каждую позицию в OrderItemReadSerializer.
+        # JOIN на users не нужен: сериализатор отдаёт user как pk (user_id), права сверяют user_id
+        queryset = Order.objects.prefetch_related(
+            Prefetch("items", queryset=OrderItem.objects.select_related("product"))
+        )
+        user = self.request.user
+        if not user.is_staff:
+            queryset = queryset.filter(user_id=user.id)
+        return get_object_or_404(queryset, pk=self.kwargs["pk"])
 
     def get(self, request, *args, **kwargs):
         pk = kwargs["pk"]
-        cache_key = f"order:{pk}"
+        cache_key = order_detail_key(pk)
         cached = cache.get(cache_key)
-        if cached is not None:
-            resp = Response(cached)
-            resp["X-Cache"] = "HIT"
-            return resp
+        # кэш общий для всех — владельца сверяем до _swr_read: чужой запрос не должен брать lock пересчёта
+        # (владелец получал бы STALE до _SWR_LOCK_TTL); чужой заказ уходит в get_object → 404
+        if isinstance(cached, tuple) and (request.user.is_staff or cached[0]["user"] == request.user.id):
+            data, cache_status = _swr_read(cache_key, cached)
+            if data is not None:
+                resp = Response(data)
+                resp["X-Cache"] = cache_status
+                return resp
 
         obj = self.get_object()
         data = OrderDetailSerializer(obj).data
-        cache.set(cache_key, data, timeout=_ttl_with_jitter())
+        _swr_set(cache_key, data)
         resp = Response(data)
         resp["X-Cache"] = "MISS"
         return resp
@@ -142,72 +251,67 @@ class OrderDetailView(generics.GenericAPIView):
         ser = OrderStatusPatchSerializer(obj, data=request.data, partial=True)
         ser.is_valid(raise_exception=True)
         ser.save()
-        # инвалидация детали (сигналы тоже почистят, но сразу ответим актуальными данными)
+        # деталь в кэше сериализатор уже инвалидировал; заново её заполнит ближайший GET
         data = OrderDetailSerializer(obj).data
-        cache.set(f"order:{obj.pk}", data, timeout=_ttl_with_jitter())
         return Response(data, status=status.HTTP_200_OK)
 
 
 # ---------- admin endpoints ----------
 
-class AdminOrderListView(generics.GenericAPIView):
+class AdminOrderListView(APIView):
     """
     GET /api/v1/admin/orders/
     Фильтры: ?status=...&user=<id>&date_from=YYYY-MM-DD&date_to=YYYY-MM-DD
     Кэш: 60с, версия admin-листа.
     """
     permission_classes = [permissions.IsAdminUser]
-    filter_backends = [filters.OrderingFilter]
-    ordering_fields = ["created_at", "total_price", "status", "user_id"]
-    ordering = ["-created_at"]
+    ordering_fields = frozenset({"created_at", "total_price", "status", "user_id"})
+    ordering = ("-created_at",)
+    # значение ordering в ключе кэша по умолчанию — считаем один раз при загрузке класса
+    _default_ordering_param = ",".join(ordering)
 
     def get_queryset(self):
-        qs = Order.objects.all().order_by(*self.ordering)
-        status_val = self.request.query_params.get("status")
-        user_id = self.request.query_params.get("user")
-        date_from = self.request.query_params.get("date_from")
-        date_to = self.request.query_params.get("date_to")
-
-        if status_val:
-            qs = qs.filter(status=status_val)
-        if user_id:
-            qs = qs.filter(user_id=user_id)
+        params = self.request.query_params
+        # все условия — одним filter(**filters): Query клонируется один раз, а не на каждый фильтр
+        filters = {}
+        if params.get("status"):
+            filters["status"] = params["status"]
+        if params.get("user"):
+            filters["user_id"] = params["user"]
+        # диапазон по самому created_at (без ::date), чтобы работал индекс; некорректные даты игнорируем
+        date_from = _day_start(params.get("date_from"))
         if date_from:
-            qs = qs.filter(created_at__date__gte=date_from)
+            filters["created_at__gte"] = date_from
+        date_to = _day_start(params.get("date_to"))
         if date_to:
-            qs = qs.filter(created_at__date__lte=date_to)
-        return qs
+            filters["created_at__lt"] = date_to + timedelta(days=1)
+        return Order.objects.filter(**filters).values(*ORDER_LIST_FIELDS)
 
     def get(self, request, *args, **kwargs):
-        params = {
-            "status": request.query_params.get("status", ""),
-            "user": request.query_params.get("user", ""),
-            "date_from": request.query_params.get("date_from", ""),
-            "date_to": request.query_params.get("date_to", ""),
-            "ordering": ",".join(request.query_params.getlist("ordering")) or "-created_at",
-            "page": request.query_params.get("page", ""),
-            "page_size": request.query_params.get("page_size", ""),
-        }
-        version = _orders_admin_list_version()
-        cache_key = f"admin:orders:list:v{version}:{_hash_params(params)}"
-
-        cached = cache.get(cache_key)
-        if cached is not None:
-            resp = Response(cached)
-            resp["X-Cache"] = "HIT"
-            return resp
-
-        qs = self.filter_queryset(self.get_queryset())
-        page = self.paginate_queryset(qs)
-        if page is not None:
-            data = OrderListSerializer(page, many=True).data
-            cache.set(cache_key, data, timeout=_ttl_with_jitter())
-            resp = self.get_paginated_response(data)
-            resp["X-Cache"] = "MISS"
+        if request.query_params:
+            params = {
+                "status": request.query_params.get("status", ""),
+                "user": request.query_params.get("user", ""),
+                "date_from": request.query_params.get("date_from", ""),
+                "date_to": request.query_params.get("date_to", ""),
+                "ordering": _ordering_param(request, self._default_ordering_param),
+            }
+            params_hash = _hash_params(params)
+        else:
+            params_hash = _DEFAULT_PARAMS_SUFFIX
+        _, cache_key, cached = _get_versioned(
+            "orders:admin:list:version",
+            lambda v: _ADMIN_LIST_KEY(v=v, h=params_hash),
+        )
+        data, cache_status = _swr_read(cache_key, cached)
+        if data is not None:
+            resp = Response(data)
+            resp["X-Cache"] = cache_status
             return resp
 
+        qs = self.get_queryset().order_by(*_ordering(request, self.ordering_fields, self.ordering))
         data = OrderListSerializer(qs, many=True).data
-        cache.set(cache_key, data, timeout=_ttl_with_jitter())
+        _LIST_L1.set(cache_key, _swr_set(cache_key, data))
         resp = Response(data)
         resp["X-Cache"] = "MISS"
         return resp
@@ -1,6 +1,5 @@
-from rest_framework import generics, status
+from rest_framework import generics
 from rest_framework.permissions import AllowAny
-from rest_framework.response import Response
 from django.contrib.auth import get_user_model
 from .serializers import RegisterSerializer
 
@@ -11,7 +10,3 @@ class RegisterView(generics.CreateAPIView):
     serializer_class = RegisterSerializer
     permission_classes = []
     authentication_classes = []
-
-    def create(self, request, *args, **kwargs):
-        resp = super().create(request, *args, **kwargs)
-        return Response(resp.data, status=status.HTTP_201_CREATED)
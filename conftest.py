@@ -48,3 +48,16 @@ def admin_client(admin_user):
     client = APIClient()
     client.force_authenticate(admin_user)
     return client
+
+class _NoCacheReads:
+    """Заглушка Memcached: любое чтение — ошибка теста."""
+
+    def get(self, *args, **kwargs):
+        raise AssertionError("unexpected cache read")
+
+    get_many = get
+
+@pytest.fixture
+def no_cache_reads():
+    """Подменяет кэш модуля (monkeypatch.setattr(views, "cache", no_cache_reads)): проверка, что запрос обслужен из L1."""
+    return _NoCacheReads()
@@ -0,0 +1,85 @@
+"""
+Общие утилиты кэша для приложений (catalog, orders):
+версии списков в Memcached + их копия в памяти процесса, in-process L1 перед Memcached.
+"""
+import threading
+import time
+
+from django.core.cache import cache
+
+
+# ---------- версии списков ----------
+
+# версии списков, известные процессу: key -> (version, monotonic-срок свежести).
+# Вью в пределах LOCAL_VERSION_TTL не читают версию из Memcached;
+# bump в этом процессе записывает новую версию сразу — свои изменения видны без задержки,
+# чужие — не позже чем через LOCAL_VERSION_TTL.
+LOCAL_VERSION_TTL = 1.0
+_LOCAL_VERSIONS_MAX = 4096  # версии per-user: не даём словарю расти с числом пользователей
+_LOCAL_VERSIONS: dict[str, tuple[int, float]] = {}
+_LOCAL_VERSIONS_LOCK = threading.Lock()
+
+
+def local_list_version(key: str) -> tuple[int | None, bool]:
+    """(последняя известная процессу версия или None, свежая ли она)."""
+    entry = _LOCAL_VERSIONS.get(key)
+    if entry is None:
+        return None, False
+    return entry[0], entry[1] > time.monotonic()
+
+
+def remember_list_version(key: str, version: int) -> None:
+    with _LOCAL_VERSIONS_LOCK:
+        if key not in _LOCAL_VERSIONS and len(_LOCAL_VERSIONS) >= _LOCAL_VERSIONS_MAX:
+            _LOCAL_VERSIONS.clear()  # записи живут секунду — проще сбросить всё, чем вести LRU
+        _LOCAL_VERSIONS[key] = (version, time.monotonic() + LOCAL_VERSION_TTL)
+
+
+def incr_version(key: str, initial: int = 1) -> None:
+    """
+    Атомарно инкрементируем версию кэш-списков — обычно за один round-trip.
+    Если ключа нет (ValueError) — создаём сразу со значением initial + 1 через add;
+    проигравший гонку add означает, что ключ уже создан другим процессом, — повторяем incr.
+    """
+    try:
+        version = cache.incr(key)
+    except ValueError:
+        version = initial + 1
+        # без срока жизни: incr TTL не продлевает, и истёкший ключ вернул бы версию к initial —
+        # тогда снова совпали бы ключи данных старого поколения
+        if not cache.add(key, version, timeout=None):
+            version = cache.incr(key)
+    remember_list_version(key, version)
+
+
+# ---------- L1 ----------
+
+class LocalCache:
+    """
+    In-process L1 перед Memcached: dict с TTL записи и ограничением размера
+    (при переполнении вытесняем самую старую запись). Явной инвалидации нет —
+    ключи содержат версию, а TTL ограничивает устаревание данных из других процессов.
+    """
+
+    def __init__(self, max_size: int, ttl: float | None = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data: dict = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        entry = self._data.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            return None
+        return entry[1]
+
+    def set(self, key, value, ttl: float | None = None) -> None:
+        expires = time.monotonic() + (ttl if ttl is not None else self.ttl)
+        with self._lock:
+            if key not in self._data and len(self._data) >= self.max_size:
+                self._data.pop(next(iter(self._data)))
+            self._data[key] = (expires, value)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
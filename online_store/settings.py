@@ -3,6 +3,8 @@ from decouple import config
 from pathlib import Path
 from datetime import timedelta
 
+from pymemcache.serde import CompressedSerde
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -105,6 +107,20 @@ CACHES = {
         # "LOCATION": "127.0.0.1:11211", # для локальной разработки
         "LOCATION": "memcached:11211", # это для Docker / продакшена
         "TIMEOUT": 300,
+        # пул соединений pymemcache: не больше max_pool_size сокетов на процесс, переиспользуются между
+        # потоками; таймауты и ретраи — чтобы недоступный memcached не вешал запросы
+        "OPTIONS": {
+            "use_pooling": True,
+            "max_pool_size": 50,
+            "no_delay": True,
+            "connect_timeout": 1,
+            "timeout": 1,
+            "retry_attempts": 2,
+            "retry_timeout": 1,
+            # pickle + zlib для значений от 1 КБ (списки заказов/товаров): меньше байт по сети и в памяти
+            # memcached; мелкие значения (версии, детали) пишутся как есть
+            "serde": CompressedSerde(min_compress_len=1024),
+        },
     }
 }
 